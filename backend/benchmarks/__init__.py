@@ -0,0 +1,2 @@
+# Benchmarks locais (sem rede) para o backend.
+# Execute a partir da pasta backend, ex.: python -m benchmarks.enrichment
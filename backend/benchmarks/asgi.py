@@ -0,0 +1,73 @@
+# asgi.py
+"""
+Cliente ASGI mínimo para exercitar o app FastAPI em processo, sem rede.
+"""
+import asyncio, json, uuid
+
+
+class ASGIResponse:
+    def __init__(self, status, headers, body):
+        self.status_code = status
+        self.headers = headers
+        self.content = body
+
+    def json(self):
+        return json.loads(self.content)
+
+
+async def request(app, method, path, body=b"", headers=None, query=""):
+    headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "headers": headers,
+        "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+    }
+    sent = False
+    finished = asyncio.Event()
+    status, resp_headers, chunks = None, {}, []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Só desconecta depois da resposta completa (respostas em streaming)
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, resp_headers
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            resp_headers = {k.decode(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return ASGIResponse(status, resp_headers, b"".join(chunks))
+
+
+def multipart(field, filename, content, content_type="image/png"):
+    """
+    Monta um corpo multipart/form-data com um único arquivo.
+    """
+    return multipart_files(field, [(filename, content, content_type)])
+
+
+def multipart_files(field, files):
+    """
+    Corpo multipart/form-data com vários arquivos [(filename, content, content_type)] no mesmo campo.
+    """
+    boundary = uuid.uuid4().hex
+    body = b""
+    for filename, content, content_type in files:
+        body += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode() + content + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return body, {"content-type": f"multipart/form-data; boundary={boundary}"}
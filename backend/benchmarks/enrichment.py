@@ -0,0 +1,72 @@
+# enrichment.py
+"""
+Mede o tempo de parede de generate_stride_report contra o nível de
+concorrência, usando o cliente falso.
+
+    python -m benchmarks.enrichment --components 20 --latency 0.2 --workers 1 4 8 16
+
+Com --cache, cada nível roda contra um cache novo, duas vezes (frio e quente).
+"""
+import argparse, os, tempfile, threading, time
+
+import processing
+from cache import EnrichmentCache
+from benchmarks.fake_openai import FakeOpenAI
+
+TYPES = list(processing.STRIDE_MAP.keys())
+
+
+def synthetic_components(n):
+    return [{"id": f"c{i}", "label": f"Componente {i}", "type": TYPES[i % len(TYPES)]} for i in range(n)]
+
+
+def run(components, latency, workers, error_rate=0.0, mode="batch"):
+    client = FakeOpenAI(latency=latency, error_rate=error_rate, seed=42)
+    processing.set_llm_client(client)
+    original_mode = processing.ENRICH_MODE
+    processing.ENRICH_MODE = mode
+    try:
+        start = time.perf_counter()
+        report = processing.generate_stride_report(
+            {"components": components, "analysis_id": "bench"}, max_workers=workers
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        processing.set_llm_client(None)
+        processing.ENRICH_MODE = original_mode
+    return elapsed, report, client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--components", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--cache", action="store_true", help="mede também a execução com cache quente")
+    parser.add_argument("--modes", nargs="+", default=["single", "batch"], choices=["single", "batch"])
+    args = parser.parse_args()
+
+    processing.ENRICH_BACKOFF = 0.05
+    # O limite global de chamadas simultâneas não pode cortar os níveis medidos
+    processing._llm_slots = threading.BoundedSemaphore(max(args.workers))
+    original_cache = processing.enrichment_cache
+    components = synthetic_components(args.components)
+    print(f"{'mode':>6} {'workers':>8} {'cache':>6} {'threats':>8} {'calls':>6} {'tokens':>8} "
+          f"{'fallbacks':>9} {'max_in_flight':>14} {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in args.modes:
+            for w in args.workers:
+                processing.enrichment_cache = (
+                    EnrichmentCache(os.path.join(tmp, f"cache_{mode}_{w}.sqlite")) if args.cache else None
+                )
+                for label in (("frio", "quente") if args.cache else ("-",)):
+                    elapsed, report, client = run(components, args.latency, w, args.error_rate, mode)
+                    usage = report["usage"]
+                    print(f"{mode:>6} {w:>8} {label:>6} {len(report['threats']):>8} {client.calls:>6} "
+                          f"{usage['total_tokens']:>8} {usage['fallbacks']:>9} {client.max_in_flight:>14} {elapsed:>8.2f}")
+    processing.enrichment_cache = original_cache
+
+
+if __name__ == "__main__":
+    main()
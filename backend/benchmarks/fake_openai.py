@@ -0,0 +1,154 @@
+# fake_openai.py
+"""
+Cliente falso compatível com `client.chat.completions.create(...)` para
+medir o backend sem rede e sem custo. As respostas são sintéticas ou, com
+`recording`, reproduzidas de uma gravação feita com benchmarks.replay.
+"""
+import json, random, re, threading, time
+from types import SimpleNamespace
+
+from benchmarks.replay import load_recording, request_key, request_kind
+
+
+TYPES = ["user", "web_server", "api_gateway", "service", "database", "storage", "load_balancer", "identity_provider"]
+
+
+def synthetic_diagram(n):
+    """
+    Diagrama em cadeia com `n` componentes no formato retornado por analyze_image.
+    """
+    components = [
+        {"id": f"c{i}", "label": f"Componente {i}", "type": TYPES[i % len(TYPES)], "bbox": [0, 0, 0, 0]}
+        for i in range(n)
+    ]
+    nodes = [c["id"] for c in components]
+    edges = [[nodes[i], nodes[i + 1]] for i in range(n - 1)]
+    return {"components": components, "graph": {"nodes": nodes, "edges": edges}}
+
+
+class FakeAPIError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeChatCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner._complete(**kwargs)
+
+
+class FakeOpenAI:
+    """
+    Simula a latência do LLM (`latency` segundos, com `jitter` opcional),
+    injeta erros HTTP `error_status` (429 = rate limit) com probabilidade
+    `error_rate` e respostas que não são JSON com probabilidade `malformed_rate`.
+
+    Com `recording` (caminho ou dict de load_recording), requisições gravadas
+    recebem a resposta gravada; com replay_latency, também a latência gravada.
+    As demais continuam sintéticas.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.0, error_rate=0.0, seed=None, diagram_components=8,
+                 error_status=429, malformed_rate=0.0, recording=None, replay_latency=False):
+        self.latency = latency
+        self.diagram_components = diagram_components
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.malformed_rate = malformed_rate
+        self.recording = load_recording(recording) if isinstance(recording, str) else (recording or {})
+        self.replay_latency = replay_latency
+        self.chat = SimpleNamespace(completions=FakeChatCompletions(self))
+        self.calls = 0
+        self.errors = 0
+        self.malformed = 0
+        self.replayed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+        self._replay_pos = {}
+        self._lock = threading.Lock()
+
+    def _recorded(self, kwargs):
+        # Gravações repetidas da mesma requisição são servidas em rodízio
+        entries = self.recording.get(request_key(kwargs)) if self.recording else None
+        if not entries:
+            return None
+        with self._lock:
+            pos = self._replay_pos.get(id(entries), 0)
+            self._replay_pos[id(entries)] = pos + 1
+            self.replayed += 1
+        return entries[pos % len(entries)]
+
+    def _complete(self, **kwargs):
+        recorded = self._recorded(kwargs)
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            fail = self._random.random() < self.error_rate
+            malformed = self._random.random() < self.malformed_rate
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if recorded is not None and self.replay_latency:
+            delay = recorded.get("latency", delay)
+        try:
+            timeout = kwargs.get("timeout")
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise TimeoutError("fake timeout")
+            time.sleep(delay)
+            if fail:
+                with self._lock:
+                    self.errors += 1
+                raise FakeAPIError(f"fake HTTP {self.error_status}", self.error_status)
+            if malformed:
+                with self._lock:
+                    self.malformed += 1
+                return self._wrap("Desculpe, não consegui gerar o JSON.", kwargs.get("messages", []))
+            if recorded is not None:
+                return self._wrap(recorded["content"], kwargs.get("messages", []), recorded.get("usage"))
+            return self._response(kwargs.get("messages", []))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _response(self, messages):
+        # Imagem -> diagrama; <componentes> -> lote; demais -> uma ameaça
+        prompt = messages[-1].get("content", "") if messages else ""
+        batch = re.search(r"<componentes>\s*(\[.*?\])\s*</componentes>", prompt, re.S) if isinstance(prompt, str) else None
+        if request_kind(messages) == "vision":
+            content = json.dumps(synthetic_diagram(self.diagram_components), ensure_ascii=False)
+        elif batch:
+            items = json.loads(batch.group(1))
+            content = json.dumps({"components": [
+                {"id": item["id"], "threats": [
+                    {"threat_type": t, "description": f"Descrição sintética de {t}.", "mitigation": "Mitigação sintética."}
+                    for t in item["threats"]
+                ]} for item in items
+            ]}, ensure_ascii=False)
+        else:
+            content = json.dumps({
+                "description": "Descrição sintética do risco.",
+                "mitigation": "Mitigação sintética."
+            }, ensure_ascii=False)
+        return self._wrap(content, messages)
+
+    def _wrap(self, content, messages, usage=None):
+        if usage is None:
+            prompt_tokens = len(json.dumps(messages, ensure_ascii=False)) // 4
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
+        )
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
@@ -0,0 +1,74 @@
+# load_server.py
+"""
+Teste de carga do app com LLM falso: mede a latência de /api/upload enquanto
+várias análises STRIDE completas estão em andamento, com o trabalho bloqueante
+nos pools (padrão) ou executado direto no event loop (comportamento antigo).
+
+    python -m benchmarks.load_server --stride 4 --uploads 50 --latency 0.2
+"""
+import argparse, asyncio, statistics, time
+
+import processing
+import server
+from benchmarks import asgi
+from benchmarks.fake_openai import FakeOpenAI, synthetic_diagram
+from benchmarks.stats import percentile
+
+
+async def _inline(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+async def _analysis_with_components(n):
+    body, headers = asgi.multipart("file", "diagram.png", b"\x89PNG fake")
+    res = await asgi.request(server.app, "POST", "/api/upload", body, headers)
+    analysis_id = res.json()["analysis_id"]
+    comps = synthetic_diagram(n)["components"]
+    server.store.set_components(analysis_id, [{"id": c["id"], "label": c["label"], "type": c["type"]} for c in comps])
+    return analysis_id
+
+
+async def scenario(stride_runs, uploads, components):
+    ids = [await _analysis_with_components(components) for _ in range(stride_runs)]
+    body, headers = asgi.multipart("file", "diagram.png", b"\x89PNG fake")
+
+    async def upload_at(scheduled):
+        # Latência medida a partir do instante planejado: se o event loop
+        # estiver travado, o atraso até a requisição começar também conta.
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        await asgi.request(server.app, "POST", "/api/upload", body, headers)
+        return time.perf_counter() - scheduled
+
+    start = time.perf_counter()
+    upload_tasks = [asyncio.create_task(upload_at(start + 0.01 * (i + 1))) for i in range(uploads)]
+    stride_tasks = [
+        asyncio.create_task(asgi.request(server.app, "GET", f"/api/stride/{i}")) for i in ids
+    ]
+    latencies = await asyncio.gather(*upload_tasks)
+    await asyncio.gather(*stride_tasks)
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stride", type=int, default=4, help="análises STRIDE simultâneas")
+    parser.add_argument("--uploads", type=int, default=50)
+    parser.add_argument("--components", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    processing.set_llm_client(FakeOpenAI(latency=args.latency, seed=1))
+    processing.enrichment_cache = None
+    original = server.run_blocking, server.run_llm
+    print(f"{'modo':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for mode in ("inline", "pool"):
+        server.run_blocking, server.run_llm = (_inline, _inline) if mode == "inline" else original
+        latencies, _ = asyncio.run(scenario(args.stride, args.uploads, args.components))
+        ms = [v * 1000 for v in latencies]
+        print(f"{mode:>8} {statistics.median(ms):>8.1f} {percentile(ms, 99):>8.1f} {max(ms):>8.1f}")
+    server.run_blocking, server.run_llm = original
+    processing.set_llm_client(None)
+
+
+if __name__ == "__main__":
+    main()
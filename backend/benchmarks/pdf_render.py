@@ -0,0 +1,59 @@
+# pdf_render.py
+"""
+Renderiza relatórios sintéticos com 100, 1.000 e 10.000 ameaças em cada
+modo de PDF e registra tempo, pico de memória (tracemalloc) e tamanho.
+
+    python -m benchmarks.pdf_render --threats 100 1000 10000 --modes full fast summary
+"""
+import argparse, os, tempfile, time, tracemalloc
+
+import processing
+from report_pdf import PDF_MODES, render_pdf
+
+TEXT = (
+    "Um atacante pode explorar a falta de validação de entrada para alterar dados em trânsito "
+    "ou em repouso, comprometendo a integridade das informações processadas pelo componente. "
+)
+
+
+def synthetic_report(n, threats_per_component=6):
+    types = list(processing.SEVERITY_MAP)
+    threats = []
+    for i in range(n):
+        t = types[i % len(types)]
+        threats.append({
+            "title": f"{t} on Componente {i // threats_per_component}",
+            "component": f"Componente {i // threats_per_component}",
+            "threat_type": t,
+            "severity": processing.SEVERITY_MAP[t],
+            "description": TEXT * 2,
+            "mitigation": TEXT,
+        })
+    return {"analysis_id": "bench", "threats": threats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threats", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--modes", nargs="+", default=list(PDF_MODES), choices=PDF_MODES)
+    args = parser.parse_args()
+
+    print(f"{'ameaças':>8} {'modo':>8} {'segundos':>9} {'pico MB':>8} {'PDF KB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.threats:
+            report = synthetic_report(n)
+            for mode in args.modes:
+                path = os.path.join(tmp, f"{n}_{mode}.pdf")
+                # Tempo e memória em execuções separadas: tracemalloc distorce o tempo
+                start = time.perf_counter()
+                render_pdf(report, "bench", path, mode)
+                elapsed = time.perf_counter() - start
+                tracemalloc.start()
+                render_pdf(report, "bench", path, mode)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(f"{n:>8} {mode:>8} {elapsed:>9.2f} {peak / 1e6:>8.1f} {os.path.getsize(path) / 1024:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# preprocess.py
+"""
+Compara, por imagem sintética de diagrama, os bytes enviados ao modelo de
+visão, os tokens de imagem estimados e o tempo de preparo, sem e com o
+pré-processamento.
+
+    python -m benchmarks.preprocess --sizes 1200x800 4000x3000 9000x6000 --tiles 6
+"""
+import argparse, base64, io, os, random, tempfile, time
+
+from PIL import Image, ImageDraw
+
+from preprocess import ImagePreprocessor, estimate_vision_tokens
+
+
+def synthetic_diagram(width, height, path, seed=0):
+    """
+    Caixas rotuladas ligadas por linhas, com alpha (como exports de ferramentas de diagrama).
+    """
+    rnd = random.Random(seed)
+    img = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    boxes = []
+    for i in range(max(4, width * height // 400_000)):
+        x, y = rnd.randrange(0, width - 220), rnd.randrange(0, height - 120)
+        boxes.append((x, y))
+        draw.rectangle([x, y, x + 200, y + 100], fill=(220, 235, 255, 255), outline=(0, 0, 0, 255), width=3)
+        draw.text((x + 10, y + 40), f"Componente {i}", fill=(0, 0, 0, 255))
+    for a, b in zip(boxes, boxes[1:]):
+        draw.line([a[0] + 100, a[1] + 50, b[0] + 100, b[1] + 50], fill=(60, 60, 60, 255), width=2)
+    img.save(path, format="PNG")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", nargs="+", default=["1200x800", "4000x3000", "9000x6000"])
+    parser.add_argument("--tiles", type=int, default=0, help="máximo de recortes (0 desativa)")
+    args = parser.parse_args()
+
+    print(f"{'imagem':>10} {'modo':>6} {'partes':>6} {'bytes b64':>11} {'tokens':>7} {'ms':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            width, height = (int(v) for v in size.split("x"))
+            path = os.path.join(tmp, f"{size}.png")
+            synthetic_diagram(width, height, path)
+
+            start = time.perf_counter()
+            with open(path, "rb") as f:
+                raw_b64 = base64.b64encode(f.read())
+            raw_ms = (time.perf_counter() - start) * 1000
+            print(f"{size:>10} {'antes':>6} {1:>6} {len(raw_b64):>11} {estimate_vision_tokens(width, height):>7} {raw_ms:>8.1f}")
+
+            prep = ImagePreprocessor(os.path.join(tmp, f"cache_{size}"), max_tiles=args.tiles)
+            for label in ("depois", "cache"):
+                start = time.perf_counter()
+                parts = prep.prepare(path)
+                encoded = [base64.b64encode(data) for _, data in parts]
+                ms = (time.perf_counter() - start) * 1000
+                tokens = 0
+                for _, data in parts:
+                    with Image.open(io.BytesIO(data)) as img:
+                        tokens += estimate_vision_tokens(*img.size)
+                print(f"{size:>10} {label:>6} {len(parts):>6} {sum(map(len, encoded)):>11} {tokens:>7} {ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# replay.py
+"""
+Gravação de respostas reais de `chat.completions.create` para reprodução
+offline com FakeOpenAI(recording=...).
+
+    OPENAI_API_KEY=... python -m benchmarks.replay diagrama.png --out gravacao.jsonl
+
+Cada linha do JSONL guarda a chave da requisição (modelo + mensagens, com
+imagens reduzidas ao hash), o tipo (vision, enrich, enrich_batch), o
+conteúdo, o uso de tokens e a latência observada.
+"""
+import argparse, hashlib, json, threading, time
+from types import SimpleNamespace
+
+
+def _normalize_content(content):
+    if not isinstance(content, list):
+        return content
+    parts = []
+    for part in content:
+        if isinstance(part, dict) and part.get("type") == "image_url":
+            url = part.get("image_url", {}).get("url", "")
+            parts.append({"type": "image_url", "sha256": hashlib.sha256(url.encode()).hexdigest()})
+        else:
+            parts.append(part)
+    return parts
+
+
+def request_key(kwargs):
+    messages = [
+        {"role": m.get("role"), "content": _normalize_content(m.get("content"))}
+        for m in kwargs.get("messages", [])
+    ]
+    payload = json.dumps({"model": kwargs.get("model"), "messages": messages}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def request_kind(messages):
+    if any(isinstance(m.get("content"), list) for m in messages):
+        return "vision"
+    prompt = messages[-1].get("content", "") if messages else ""
+    return "enrich_batch" if isinstance(prompt, str) and "</componentes>" in prompt else "enrich"
+
+
+def load_recording(path):
+    """
+    Lê um JSONL gravado: {chave: [entradas na ordem de gravação]}.
+    """
+    recording = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recording.setdefault(entry["key"], []).append(entry)
+    return recording
+
+
+class RecordingClient:
+    """
+    Envolve um cliente real e grava cada resposta bem-sucedida em `path`.
+    """
+
+    def __init__(self, client, path):
+        self._client = client
+        self._path = path
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        start = time.perf_counter()
+        response = self._client.chat.completions.create(**kwargs)
+        usage = getattr(response, "usage", None)
+        entry = {
+            "key": request_key(kwargs),
+            "kind": request_kind(kwargs.get("messages", [])),
+            "content": response.choices[0].message.content,
+            "usage": {
+                "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+                "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            },
+            "latency": round(time.perf_counter() - start, 4),
+        }
+        with self._lock, open(self._path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+", help="diagramas a analisar com o LLM real")
+    parser.add_argument("--out", required=True, help="arquivo JSONL de saída (acrescenta ao final)")
+    args = parser.parse_args()
+
+    import openai, processing
+
+    # Sem cache: toda requisição precisa chegar ao LLM para ser gravada
+    processing.enrichment_cache = None
+    processing.image_index = None
+    processing.set_llm_client(RecordingClient(openai, args.out))
+    try:
+        for i, image in enumerate(args.images):
+            analysis = processing.analyze_image(image, f"record-{i}", use_cache=False)
+            report = processing.generate_stride_report(analysis)
+            print(f"{image}: {len(analysis.get('components', []))} componentes, {len(report['threats'])} ameaças")
+    finally:
+        processing.set_llm_client(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# stats.py
+"""
+Percentis e tabela de resultados compartilhados pelos benchmarks.
+"""
+import statistics
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def summarize(operation, latencies, elapsed, errors=0):
+    """
+    Vazão (operações/s no tempo de parede `elapsed`) e latências em ms.
+    """
+    ms = [v * 1000 for v in latencies]
+    row = {
+        "operation": operation,
+        "n": len(ms),
+        "errors": errors,
+        "throughput": len(ms) / elapsed if elapsed > 0 else 0.0,
+        "mean_ms": statistics.fmean(ms) if ms else 0.0,
+    }
+    for p in PERCENTILES:
+        row[f"p{p}_ms"] = percentile(ms, p)
+    row["max_ms"] = max(ms) if ms else 0.0
+    return row
+
+
+def print_table(rows):
+    columns = ["n", "errors", "throughput", "mean_ms"] + [f"p{p}_ms" for p in PERCENTILES] + ["max_ms"]
+    width = max([len("operation")] + [len(r["operation"]) for r in rows])
+    print(f"{'operation':<{width}} " + " ".join(f"{c:>10}" for c in columns))
+    for row in rows:
+        cells = [f"{row[c]:>10}" if isinstance(row[c], int) else f"{row[c]:>10.1f}" for c in columns]
+        print(f"{row['operation']:<{width}} " + " ".join(cells))
+
+
+def print_comparison(rows, baseline):
+    """
+    Variação percentual de vazão e p50/p95 em relação a uma execução anterior.
+    """
+    previous = {r["operation"]: r for r in baseline}
+    print(f"\n{'operation':<24} {'throughput':>11} {'p50':>8} {'p95':>8}")
+    for row in rows:
+        old = previous.get(row["operation"])
+        if old is None:
+            continue
+
+        def delta(key):
+            return f"{(row[key] - old[key]) / old[key] * 100:+.0f}%" if old[key] else "-"
+
+        print(f"{row['operation']:<24} {delta('throughput'):>11} {delta('p50_ms'):>8} {delta('p95_ms'):>8}")
@@ -0,0 +1,277 @@
+# workload.py
+"""
+Harness de carga reprodutível com o LLM falso: executa cenários contra
+analyze_image, enrich_with_openai e os endpoints do FastAPI (em processo)
+e imprime vazão e percentis de latência por operação.
+
+    python -m benchmarks.workload --scenarios analyze enrich api batch --requests 200 --concurrency 16
+    python -m benchmarks.workload --components 60 --image-size 6000x4000      # diagramas grandes
+    python -m benchmarks.workload --repeat-ratio 0.8                          # diagramas repetidos
+    python -m benchmarks.workload --error-rate 0.05 --error-status 503 --malformed-rate 0.02
+    python -m benchmarks.workload --recording gravacao.jsonl --replay-latency
+    python -m benchmarks.workload --json atual.json --baseline anterior.json
+
+Cada execução usa bancos, caches e diretórios temporários próprios, então
+o resultado não depende de execuções anteriores; com a mesma --seed, a
+sequência de requisições e de erros injetados se repete.
+"""
+import argparse, asyncio, json, os, random, shutil, tempfile, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import processing
+import server
+from cache import EnrichmentCache
+from image_cache import ImageIndex
+from preprocess import ImagePreprocessor
+from storage import AnalysisStore
+from benchmarks import asgi
+from benchmarks.fake_openai import FakeOpenAI, synthetic_diagram
+from benchmarks.stats import summarize, print_table, print_comparison
+
+SCENARIOS = ("analyze", "enrich", "api", "batch")
+
+
+def _make_image(path, size, seed):
+    try:
+        from benchmarks.preprocess import synthetic_diagram as draw_diagram
+    except ImportError:
+        # Sem Pillow: bytes únicos bastam para o fluxo (o pré-processamento repassa o arquivo)
+        with open(path, "wb") as f:
+            f.write(b"\x89PNG fake " + str(seed).encode())
+        return
+    width, height = size
+    draw_diagram(width, height, path, seed=seed)
+
+
+def plan_images(directory, requests, repeat_ratio, size, seed):
+    """
+    Um caminho de imagem por requisição: com probabilidade repeat_ratio, o
+    mesmo diagrama "quente"; senão, um diagrama inédito.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rnd = random.Random(seed)
+    hot = os.path.join(directory, "hot.png")
+    _make_image(hot, size, seed)
+    plan = []
+    for i in range(requests):
+        if i > 0 and rnd.random() < repeat_ratio:
+            plan.append(hot)
+        else:
+            path = os.path.join(directory, f"img_{i}.png")
+            _make_image(path, size, seed + i + 1)
+            plan.append(path)
+    return plan
+
+
+def _run_threads(fn, items, concurrency):
+    """
+    Executa fn(item) com `concurrency` threads; retorna (latências, erros, tempo de parede).
+    """
+    def timed(item):
+        start = time.perf_counter()
+        try:
+            ok = fn(item)
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, items))
+    elapsed = time.perf_counter() - start
+    return [r[0] for r in results], sum(1 for r in results if not r[1]), elapsed
+
+
+def scenario_analyze(args, images, workdir):
+    def analyze(path):
+        # Cópia por requisição, como um upload novo
+        target = os.path.join(workdir, f"{uuid.uuid4().hex}.png")
+        shutil.copyfile(path, target)
+        result = processing.analyze_image(target, str(uuid.uuid4()))
+        return not result.get("error")
+
+    latencies, errors, elapsed = _run_threads(analyze, images, args.concurrency)
+    return [summarize("analyze_image", latencies, elapsed, errors)]
+
+
+def scenario_enrich(args, _images, _workdir):
+    rnd = random.Random(args.seed)
+    components = synthetic_diagram(args.components)["components"]
+    pairs = []
+    for _ in range(args.requests):
+        # Pares repetidos (mesmo rótulo e ameaça) exercitam o cache de enriquecimento
+        comp = components[0] if rnd.random() < args.repeat_ratio else rnd.choice(components)
+        _, _, candidates = processing._stride_candidates(comp)
+        pairs.append((rnd.choice(candidates), comp))
+
+    def enrich(pair):
+        result = processing.enrich_with_openai(*pair)
+        return result["description"] != "Descrição não disponível"
+
+    latencies, errors, elapsed = _run_threads(enrich, pairs, args.concurrency)
+    return [summarize("enrich_with_openai", latencies, elapsed, errors)]
+
+
+async def _api_flow(path, timings, semaphore):
+    """
+    Fluxo do frontend: upload, componentes, STRIDE completo e download do JSON.
+    """
+    async def step(name, method, route, body=b"", headers=None, query=""):
+        start = time.perf_counter()
+        res = await asgi.request(server.app, method, route, body, headers, query)
+        failed = res.status_code >= 400
+        timings.setdefault(name, []).append((time.perf_counter() - start, failed))
+        return None if failed else res
+
+    async with semaphore:
+        flow_start = time.perf_counter()
+        with open(path, "rb") as f:
+            body, headers = asgi.multipart("file", "diagram.png", f.read())
+        res = await step("POST /api/upload", "POST", "/api/upload", body, headers)
+        ok = res is not None
+        if ok:
+            analysis_id = res.json()["analysis_id"]
+            ok = (
+                await step("GET /api/components", "GET", f"/api/components/{analysis_id}") is not None
+                and await step("GET /api/stride", "GET", f"/api/stride/{analysis_id}") is not None
+                and await step("GET /api/report/download", "GET", f"/api/report/{analysis_id}/download",
+                               query="format=json") is not None
+            )
+        timings.setdefault("api:flow", []).append((time.perf_counter() - flow_start, not ok))
+
+
+def scenario_api(args, images, _workdir):
+    async def run():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        timings = {}
+        start = time.perf_counter()
+        await asyncio.gather(*(_api_flow(path, timings, semaphore) for path in images))
+        return timings, time.perf_counter() - start
+
+    timings, elapsed = asyncio.run(run())
+    return [
+        summarize(name, [t for t, _ in values], elapsed, sum(1 for _, failed in values if failed))
+        for name, values in timings.items()
+    ]
+
+
+def scenario_batch(args, images, _workdir):
+    """
+    Os mesmos diagramas do cenário api, enviados num único POST /api/batch
+    (em lotes de até BATCH_MAX_FILES), até o relatório consolidado.
+    """
+    size = server.BATCH_MAX_FILES
+
+    async def one_batch(paths):
+        files = []
+        for i, path in enumerate(paths):
+            with open(path, "rb") as f:
+                files.append((f"diagram_{i}.png", f.read(), "image/png"))
+        body, headers = asgi.multipart_files("files", files)
+        start = time.perf_counter()
+        res = await asgi.request(server.app, "POST", "/api/batch", body, headers)
+        if res.status_code != 202:
+            return time.perf_counter() - start, False
+        job_id = res.json()["job_id"]
+        while True:
+            job = (await asgi.request(server.app, "GET", f"/api/jobs/{job_id}")).json()
+            if job["status"] in ("done", "failed"):
+                return time.perf_counter() - start, job["status"] == "done"
+            await asyncio.sleep(0.02)
+
+    async def run():
+        start = time.perf_counter()
+        chunks = [images[k:k + size] for k in range(0, len(images), size)]
+        results = await asyncio.gather(*(one_batch(chunk) for chunk in chunks))
+        return results, time.perf_counter() - start
+
+    results, elapsed = asyncio.run(run())
+    return [summarize("POST /api/batch (até o relatório)", [t for t, _ in results], elapsed,
+                      sum(1 for _, ok in results if not ok))]
+
+
+def _isolate(workdir, args):
+    """
+    Troca caches, índices e banco por instâncias em workdir; retorna uma função que restaura.
+    """
+    saved = (processing.enrichment_cache, processing.image_index, processing.image_preprocessor, server.store)
+    processing.enrichment_cache = (
+        EnrichmentCache(os.path.join(workdir, "enrichment_cache.sqlite")) if not args.no_cache else None
+    )
+    processing.image_index = ImageIndex(os.path.join(workdir, "image_index.sqlite")) if not args.no_dedup else None
+    if processing.image_preprocessor is not None:
+        old = processing.image_preprocessor
+        processing.image_preprocessor = ImagePreprocessor(
+            os.path.join(workdir, "prep"), max_side=old.max_side, tile_threshold=old.tile_threshold,
+            max_tiles=old.max_tiles, jpeg_quality=old.jpeg_quality,
+        )
+    server.store = AnalysisStore(os.path.join(workdir, "analyses.sqlite"))
+
+    def restore():
+        processing.enrichment_cache, processing.image_index, processing.image_preprocessor, server.store = saved
+    return restore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=100, help="requisições por cenário")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--components", type=int, default=8, help="componentes por diagrama (resposta de visão)")
+    parser.add_argument("--image-size", default="1200x800", help="LARGURAxALTURA dos diagramas gerados")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="fração de requisições repetindo o mesmo diagrama")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--recording", help="JSONL gravado com benchmarks.replay")
+    parser.add_argument("--replay-latency", action="store_true", help="usa a latência gravada")
+    parser.add_argument("--no-cache", action="store_true", help="desativa o cache de enriquecimento")
+    parser.add_argument("--no-dedup", action="store_true", help="desativa o reaproveitamento de imagens repetidas")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="grava os resultados neste arquivo")
+    parser.add_argument("--baseline", help="compara com um arquivo gravado por --json")
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.image_size.lower().split("x"))
+    processing.ENRICH_BACKOFF = min(processing.ENRICH_BACKOFF, 0.05)
+    rows, llm = [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        images = plan_images(os.path.join(tmp, "images"), args.requests, args.repeat_ratio, size, args.seed) \
+            if {"analyze", "api", "batch"} & set(args.scenarios) else []
+        for name in args.scenarios:
+            workdir = os.path.join(tmp, name)
+            os.makedirs(workdir)
+            restore = _isolate(workdir, args)
+            client = FakeOpenAI(
+                latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed,
+                diagram_components=args.components, error_status=args.error_status,
+                malformed_rate=args.malformed_rate, recording=args.recording, replay_latency=args.replay_latency,
+            )
+            processing.set_llm_client(client)
+            try:
+                rows.extend(globals()[f"scenario_{name}"](args, images, workdir))
+            finally:
+                processing.set_llm_client(None)
+                restore()
+            llm[name] = {
+                "calls": client.calls, "errors": client.errors, "malformed": client.malformed,
+                "replayed": client.replayed, "max_in_flight": client.max_in_flight,
+                "tokens": client.prompt_tokens + client.completion_tokens,
+            }
+
+    print_table(rows)
+    print()
+    for name, stats in llm.items():
+        print(f"LLM [{name}]: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "rows": rows, "llm": llm}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print_comparison(rows, json.load(f)["rows"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# cache.py
+import json, os, sqlite3, threading, time, hashlib
+from collections import OrderedDict
+
+
+def _normalize(value):
+    return " ".join(str(value or "").split()).casefold()
+
+
+def make_key(*parts):
+    """
+    Hash SHA-256 estável das partes normalizadas (espaços e caixa ignorados).
+    """
+    payload = json.dumps([_normalize(p) for p in parts], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EnrichmentCache:
+    """
+    Cache em dois níveis: LRU em memória na frente de um SQLite local.
+    Entradas expiram após `ttl` segundos; o SQLite guarda no máximo
+    `max_entries` (as menos acessadas são removidas primeiro).
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600, max_entries=100_000, memory_entries=2048):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS enrichment ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_enrichment_accessed ON enrichment(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return value
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT value, created_at FROM enrichment WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM enrichment WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE enrichment SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            self.hits_disk += 1
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO enrichment (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._conn.commit()
+            self._remember(key, now, value)
+            self._writes += 1
+            # Limpeza amortizada: não a cada escrita
+            if self._writes % 100 == 0:
+                self._evict(now)
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        cur = self._conn.execute("DELETE FROM enrichment WHERE created_at < ?", (now - self.ttl,))
+        removed = cur.rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM enrichment").fetchone()[0]
+        if count > self.max_entries:
+            cur = self._conn.execute(
+                "DELETE FROM enrichment WHERE key IN ("
+                " SELECT key FROM enrichment ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            removed += cur.rowcount
+        self._conn.commit()
+        self.evictions += removed
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM enrichment")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM enrichment").fetchone()[0]
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_entries": size,
+            }
@@ -0,0 +1,148 @@
+# graph.py
+from collections import deque
+
+# Zona de confiança por tipo de componente (tipos desconhecidos: internal)
+TRUST_ZONES = {
+    "user": "external",
+    "external": "external",
+    "external_service": "external",
+    "third_party": "external",
+    "client": "external",
+    "browser": "external",
+    "mobile_app": "external",
+    "internet": "external",
+    "load_balancer": "edge",
+    "api_gateway": "edge",
+    "web_server": "edge",
+    "cdn": "edge",
+    "identity_provider": "edge",
+    "service": "internal",
+    "database": "data",
+    "storage": "data",
+}
+ENTRY_ZONE = "external"
+
+
+def zone_of(component):
+    return TRUST_ZONES.get(component.get("type", "default"), "internal")
+
+
+def annotate(unit, hops):
+    """
+    Anota a unidade com a exposição: hops é a distância ao ponto de entrada
+    mais próximo, ou None se não houver caminho até ele.
+    """
+    unit["exposed"] = hops is not None
+    unit["hops_from_entry"] = hops
+    return unit
+
+
+def flow_unit(src, dst, hops):
+    """
+    Unidade data_flow de um fluxo src -> dst que cruza fronteira de
+    confiança; hops = {id: distância ao ponto de entrada}.
+    """
+    known = [hops[c["id"]] for c in (src, dst) if hops.get(c["id"]) is not None]
+    return annotate({
+        "id": f"flow:{src['id']}->{dst['id']}",
+        "label": f"{src.get('label', src['id'])} -> {dst.get('label', dst['id'])}",
+        "type": "data_flow",
+        "flow": [src["id"], dst["id"]],
+    }, min(known) if known else None)
+
+
+class ThreatGraph:
+    """
+    Grafo de fluxo de dados indexado (listas de adjacência) construído a
+    partir de components e graph.edges de analyze_image. Todas as consultas
+    são O(V + E).
+    """
+
+    def __init__(self, components, edges=None):
+        self.nodes = {}
+        for i, comp in enumerate(components):
+            # Ids ausentes ou repetidos (o modelo às vezes erra) ganham um id próprio
+            nid = comp.get("id")
+            if nid is None or nid in self.nodes:
+                nid = f"{nid or 'node'}_{i}"
+                comp = dict(comp, id=nid)
+            self.nodes[nid] = comp
+        self.out_edges = {nid: [] for nid in self.nodes}
+        self.in_edges = {nid: [] for nid in self.nodes}
+        self.edges = []
+        seen = set()
+        for edge in edges or []:
+            if not isinstance(edge, (list, tuple)) or len(edge) < 2:
+                continue
+            src, dst = edge[0], edge[1]
+            # Arestas para nós desconhecidos, laços e duplicatas são ignorados
+            if src not in self.nodes or dst not in self.nodes or src == dst or (src, dst) in seen:
+                continue
+            seen.add((src, dst))
+            self.edges.append((src, dst))
+            self.out_edges[src].append(dst)
+            self.in_edges[dst].append(src)
+        self._hops = None
+
+    def zone(self, node_id):
+        return zone_of(self.nodes[node_id])
+
+    def entry_points(self):
+        return [nid for nid in self.nodes if self.zone(nid) == ENTRY_ZONE]
+
+    def hops_from_entry(self):
+        """
+        Distância (em arestas) de cada nó ao ponto de entrada externo mais
+        próximo, por BFS com múltiplas origens. As arestas são percorridas nos
+        dois sentidos: setas em diagramas nem sempre indicam quem inicia a
+        conexão, e subestimar a exposição é o erro mais caro.
+        """
+        if self._hops is None:
+            hops = {}
+            queue = deque()
+            for nid in self.entry_points():
+                hops[nid] = 0
+                queue.append(nid)
+            while queue:
+                nid = queue.popleft()
+                for nxt in self.out_edges[nid] + self.in_edges[nid]:
+                    if nxt not in hops:
+                        hops[nxt] = hops[nid] + 1
+                        queue.append(nxt)
+            self._hops = hops
+        return self._hops
+
+    def trust_boundaries(self):
+        """
+        Fluxos que cruzam zonas de confiança diferentes.
+        """
+        return [(src, dst) for src, dst in self.edges if self.zone(src) != self.zone(dst)]
+
+    def stride_units(self):
+        """
+        Unidades de análise STRIDE: os componentes e os fluxos que cruzam
+        fronteiras de confiança (tipo data_flow), anotados com exposição e
+        ordenados por prioridade (expostos e mais próximos da entrada primeiro;
+        empate mantém a ordem original).
+        """
+        hops = self.hops_from_entry()
+        units = [annotate(dict(comp), hops.get(nid)) for nid, comp in self.nodes.items()]
+        for src, dst in self.trust_boundaries():
+            units.append(flow_unit(self.nodes[src], self.nodes[dst], hops))
+        order = {id(u): i for i, u in enumerate(units)}
+        return sorted(units, key=lambda u: (
+            u["hops_from_entry"] is None,
+            u["hops_from_entry"] if u["hops_from_entry"] is not None else 0,
+            order[id(u)],
+        ))
+
+    def summary(self):
+        hops = self.hops_from_entry()
+        return {
+            "nodes": list(self.nodes),
+            "edges": [list(e) for e in self.edges],
+            "entry_points": self.entry_points(),
+            "trust_boundaries": [list(e) for e in self.trust_boundaries()],
+            "exposed_nodes": [nid for nid in self.nodes if nid in hops],
+        }
+
@@ -0,0 +1,92 @@
+# image_cache.py
+import hashlib, os, sqlite3, threading, time
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow é opcional: sem ele, apenas o hash exato é usado
+    Image = None
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def dhash(path, size=8):
+    """
+    Hash perceptual (dHash) de 64 bits em hexadecimal, ou None sem Pillow
+    ou se a imagem não puder ser lida.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+            pixels = list(small.getdata())
+    except Exception:
+        return None
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return f"{bits:0{size * size // 4}x}"
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class ImageIndex:
+    """
+    Índice de imagens já analisadas: SHA-256 exato e, opcionalmente, dHash
+    para reexportações quase idênticas.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " analysis_id TEXT PRIMARY KEY, sha256 TEXT NOT NULL,"
+            " phash TEXT, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images(sha256)")
+        self._conn.commit()
+
+    def add(self, analysis_id, sha256, phash=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (analysis_id, sha256, phash, created_at) VALUES (?, ?, ?, ?)",
+                (analysis_id, sha256, phash, time.time()),
+            )
+            self._conn.commit()
+
+    def remove(self, analysis_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM images WHERE analysis_id = ?", (analysis_id,))
+            self._conn.commit()
+
+    def find(self, sha256, phash=None, max_distance=0):
+        """
+        Retorna os analysis_id candidatos, mais recentes primeiro: primeiro os
+        de hash exato, depois os de dHash a até `max_distance` bits.
+        """
+        with self._lock:
+            exact = [r[0] for r in self._conn.execute(
+                "SELECT analysis_id FROM images WHERE sha256 = ? ORDER BY created_at DESC", (sha256,)
+            )]
+            if phash is None or max_distance <= 0:
+                return exact
+            rows = self._conn.execute(
+                "SELECT analysis_id, phash FROM images WHERE phash IS NOT NULL AND sha256 != ?"
+                " ORDER BY created_at DESC", (sha256,)
+            ).fetchall()
+        near = [aid for aid, ph in rows if hamming(ph, phash) <= max_distance]
+        return exact + near
@@ -0,0 +1,113 @@
+# janitor.py
+import os, threading, time
+
+
+class Janitor:
+    """
+    Remove artefatos temporários por idade (`max_age` segundos) e, se o total
+    ainda passar de `disk_budget` bytes, os mais antigos primeiro.
+    Arquivos com sufixo em `exclude` (ex.: bancos SQLite) nunca são removidos,
+    nem os caminhos devolvidos por `in_use()` (ex.: uploads de análises vivas).
+    Hardlinks do mesmo arquivo contam uma vez só: o espaço só é liberado
+    quando o último link é removido.
+    """
+
+    def __init__(self, dirs, max_age=24 * 3600, disk_budget=0, exclude=(".sqlite", ".sqlite-wal", ".sqlite-shm"),
+                 in_use=None):
+        self.dirs = list(dirs)
+        self.max_age = max_age
+        self.disk_budget = disk_budget
+        self.exclude = tuple(exclude)
+        self.in_use = in_use
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.files_removed = 0
+        self.bytes_reclaimed = 0
+        self.bytes_in_use = 0
+        self.last_run_at = None
+
+    def _scan(self):
+        """
+        Retorna ([(mtime, inode, path)], {inode: [tamanho, links restantes]}).
+        """
+        files, inodes = [], {}
+        for d in self.dirs:
+            try:
+                entries = list(os.scandir(d))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False) or entry.name.endswith(self.exclude):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                inode = (st.st_dev, st.st_ino)
+                inodes[inode] = [st.st_size, st.st_nlink]
+                files.append((st.st_mtime, inode, entry.path))
+        return files, inodes
+
+    def _remove(self, path, inode, inodes):
+        """
+        Remove um link; retorna os bytes liberados (só no último link do arquivo).
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        inodes[inode][1] -= 1
+        return inodes[inode][0] if inodes[inode][1] <= 0 else 0
+
+    def run_once(self):
+        """
+        Executa uma varredura e retorna (arquivos removidos, bytes liberados).
+        """
+        now = time.time()
+        files, inodes = self._scan()
+        files.sort()
+        protected = {os.path.normpath(p) for p in self.in_use()} if self.in_use else set()
+        removed = reclaimed = 0
+        kept = []
+        for mtime, inode, path in files:
+            if self.max_age and now - mtime > self.max_age and os.path.normpath(path) not in protected:
+                reclaimed += self._remove(path, inode, inodes)
+                removed += 1
+            else:
+                kept.append((mtime, inode, path))
+
+        # Espaço ocupado: cada arquivo uma vez, mesmo com vários links
+        kept_links = {}
+        for _, inode, _ in kept:
+            kept_links[inode] = kept_links.get(inode, 0) + 1
+        total = sum(inodes[inode][0] for inode in kept_links)
+        if self.disk_budget:
+            # Mais antigos primeiro até caber no orçamento
+            for mtime, inode, path in kept:
+                if total <= self.disk_budget:
+                    break
+                if os.path.normpath(path) in protected:
+                    continue
+                reclaimed += self._remove(path, inode, inodes)
+                removed += 1
+                kept_links[inode] -= 1
+                if not kept_links[inode]:
+                    total -= inodes[inode][0]
+
+        with self._lock:
+            self.runs += 1
+            self.files_removed += removed
+            self.bytes_reclaimed += reclaimed
+            self.bytes_in_use = total
+            self.last_run_at = now
+        return removed, reclaimed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "files_removed": self.files_removed,
+                "bytes_reclaimed": self.bytes_reclaimed,
+                "bytes_in_use": self.bytes_in_use,
+                "last_run_at": self.last_run_at,
+            }
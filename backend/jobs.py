@@ -0,0 +1,178 @@
+# jobs.py
+import logging, queue, threading, time, uuid
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger("stride.jobs")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    """
+    Estado de um job: status (queued, running, done, failed), progresso livre
+    (dict) e resultado/erro final. on_change(job) é chamado a cada mudança
+    (ex.: para gravar o estado onde outros processos consultam).
+    """
+
+    def __init__(self, kind, job_id=None, on_change=None):
+        self.id = job_id or str(uuid.uuid4())
+        self.on_change = on_change
+        self.kind = kind
+        self.status = "queued"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._lock = threading.Lock()
+
+    def update(self, **progress):
+        with self._lock:
+            self.progress.update(progress)
+            self.updated_at = time.time()
+        self.notify()
+
+    def notify(self):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(self)
+        except Exception:
+            logger.exception("Falha ao registrar o estado do job %s", self.id)
+
+    def to_dict(self, include_result=True):
+        with self._lock:
+            data = {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "error": self.error,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+            }
+            if include_result:
+                data["result"] = self.result
+            return data
+
+
+class JobBackend(ABC):
+    """
+    Interface dos backends de jobs. `fn(job, *args)` executa o trabalho,
+    reporta progresso com job.update(...) e retorna o resultado.
+    """
+
+    @abstractmethod
+    def submit(self, kind, fn, *args):
+        ...
+
+    @abstractmethod
+    def get(self, job_id):
+        ...
+
+    def stats(self):
+        return {"queued": 0, "running": 0}
+
+    def shutdown(self):
+        pass
+
+
+class LocalJobBackend(JobBackend):
+    """
+    Backend em processo: fila limitada (`queue_size`) consumida por
+    `workers` threads. Jobs finalizados ficam disponíveis por `ttl` segundos;
+    on_change(job) recebe cada mudança de estado (ver Job).
+    """
+
+    def __init__(self, workers=4, queue_size=100, ttl=3600, on_change=None):
+        self.ttl = ttl
+        self.on_change = on_change
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._running = 0
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, kind, fn, *args):
+        self._purge()
+        job = Job(kind, on_change=self.on_change)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.notify()
+        try:
+            self._queue.put_nowait((job, fn, args))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            with job._lock:
+                job.status, job.error = "failed", "Fila de jobs cheia"
+            job.notify()
+            raise JobQueueFull(job.error)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {"queued": self._queue.qsize(), "running": self._running}
+
+    def shutdown(self):
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job, fn, args = item
+            with self._lock:
+                self._running += 1
+            with job._lock:
+                job.status = "running"
+                job.updated_at = time.time()
+            job.notify()
+            try:
+                result = fn(job, *args)
+                with job._lock:
+                    job.result = result
+                    job.status = "done"
+            except Exception as e:
+                logger.exception("Job %s (%s) falhou", job.id, job.kind)
+                with job._lock:
+                    job.error = str(e)
+                    job.status = "failed"
+            finally:
+                with self._lock:
+                    self._running -= 1
+                job.updated_at = time.time()
+                job.notify()
+                self._queue.task_done()
+
+    def _purge(self):
+        limit = time.time() - self.ttl
+        with self._lock:
+            expired = [
+                jid for jid, job in self._jobs.items()
+                if job.status in ("done", "failed") and job.updated_at < limit
+            ]
+            for jid in expired:
+                del self._jobs[jid]
+
+
+def create_backend(name="local", **options):
+    if name == "local":
+        return LocalJobBackend(**options)
+    raise ValueError(f"Backend de jobs desconhecido: {name}")
@@ -0,0 +1,215 @@
+# metrics.py
+import bisect, logging, threading, time
+from contextlib import contextmanager
+
+logger = logging.getLogger("stride")
+
+# Limites (segundos) dos histogramas de latência
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{self._label_text(key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Valor instantâneo; com `fn`, é lido na hora da coleta (sem rótulos).
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        if self.fn is not None:
+            try:
+                self.set(self.fn())
+            except Exception:
+                logger.exception("Falha ao coletar o gauge %s", self.name)
+        return super().render()
+
+
+class Histogram(_Metric):
+    """
+    Histograma cumulativo no formato Prometheus (_bucket, _sum, _count).
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts = list(counts)
+            counts[i] += 1
+            self._values[key] = (counts, total + value, n + 1)
+
+    def _render_sample(self, key, value):
+        counts, total, n = value
+        lines, cumulative = [], 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts):
+            cumulative += c
+            le = (("le", _format_value(bound)),)
+            lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {n}")
+        return lines
+
+
+class Registry:
+    """
+    Conjunto de métricas do processo; render() gera o formato texto do Prometheus.
+    Registrar de novo o mesmo nome devolve a métrica existente.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self._register(Gauge, name, help, labels, fn=fn)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+STAGE_SECONDS = histogram(
+    "stride_stage_duration_seconds", "Duração de cada etapa (upload, análise de imagem, enriquecimento, PDF)",
+    ("stage", "outcome"),
+)
+
+
+@contextmanager
+def span(stage, level=logging.INFO, **fields):
+    """
+    Mede uma etapa: registra a duração em stride_stage_duration_seconds e
+    emite uma linha de log chave=valor. Campos extras podem ser adicionados
+    ao dict retornado durante a etapa.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield fields
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage, outcome=outcome)
+        if logger.isEnabledFor(level):
+            extra = "".join(f" {k}={v}" for k, v in fields.items())
+            logger.log(level, "span stage=%s outcome=%s duration_ms=%.1f%s", stage, outcome, elapsed * 1000, extra)
+
+
+HTTP_SECONDS = histogram(
+    "http_request_duration_seconds", "Latência das requisições HTTP por rota", ("method", "route", "status"),
+)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI puro (não bufferiza o corpo, então não afeta o SSE):
+    mede cada requisição HTTP pelo template da rota, não pelo caminho.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_SECONDS.observe(
+                time.perf_counter() - start, method=scope.get("method", ""), route=route, status=status["code"]
+            )
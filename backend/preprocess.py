@@ -0,0 +1,179 @@
+# preprocess.py
+import io, json, math, os, hashlib
+
+try:
+    from PIL import Image
+except ImportError:  # sem Pillow, a imagem segue como veio (só o MIME é detectado)
+    Image = None
+
+MIME_BY_FORMAT = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+def sniff_mime(data):
+    """
+    MIME a partir dos bytes iniciais (fallback: image/png).
+    """
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:4] in (b"GIF8",):
+        return "image/gif"
+    return "image/png"
+
+
+def estimate_vision_tokens(width, height):
+    """
+    Estimativa de tokens de imagem (detail=high): a imagem é reduzida para
+    caber em 2048x2048, depois para o menor lado ter no máximo 768 px, e
+    custa 85 + 170 por bloco de 512x512.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    w, h = width * scale, height * scale
+    scale = min(1.0, 768 / min(w, h))
+    w, h = w * scale, h * scale
+    return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+
+
+class ImagePreprocessor:
+    """
+    Normaliza a imagem antes da análise de visão: reduz para `max_side`,
+    recomprime (PNG ou JPEG, o que for menor) e, opcionalmente (`max_tiles` > 0),
+    para diagramas maiores que `tile_threshold` envia uma visão geral mais até
+    `max_tiles` recortes em resolução legível; os recortes melhoram a leitura de
+    rótulos pequenos, mas multiplicam os tokens de imagem.
+    O resultado fica em cache em `cache_dir`.
+    """
+
+    def __init__(self, cache_dir, max_side=2048, tile_threshold=4096, max_tiles=0, jpeg_quality=85):
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.tile_threshold = tile_threshold
+        self.max_tiles = max_tiles
+        self.jpeg_quality = jpeg_quality
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_key(self, sha):
+        params = f"{self.max_side}:{self.tile_threshold}:{self.max_tiles}:{self.jpeg_quality}"
+        return hashlib.sha256(f"{sha}:{params}".encode()).hexdigest()[:32]
+
+    def prepare(self, path, sha=None):
+        """
+        Retorna a lista de partes [(mime, bytes)] a enviar ao modelo.
+        """
+        with open(path, "rb") as f:
+            raw = f.read()
+        if Image is None:
+            return [(sniff_mime(raw), raw)]
+
+        key = self._cache_key(sha or hashlib.sha256(raw).hexdigest())
+        cached = self._load(key)
+        if cached is not None:
+            return cached
+
+        try:
+            parts = self._process(raw)
+        except Exception:
+            return [(sniff_mime(raw), raw)]
+        self._store(key, parts)
+        return parts
+
+    def _process(self, raw):
+        with Image.open(io.BytesIO(raw)) as img:
+            fmt = img.format
+            img.load()
+            img = _flatten(img)
+        width, height = img.size
+
+        if max(width, height) <= self.max_side:
+            encoded = self._encode(img)
+            # Imagem já pequena: mantém o original se a recompressão não ajudar
+            if fmt in MIME_BY_FORMAT and len(raw) <= len(encoded[1]):
+                return [(MIME_BY_FORMAT[fmt], raw)]
+            return [encoded]
+
+        overview = self._encode(_fit(img, self.max_side))
+        if max(width, height) <= self.tile_threshold or self.max_tiles <= 0:
+            return [overview]
+
+        tiles = _tile_boxes(width, height, self.max_side, self.max_tiles)
+        return [overview] + [self._encode(_fit(img.crop(box), self.max_side)) for box in tiles]
+
+    def _encode(self, img):
+        png = io.BytesIO()
+        img.save(png, format="PNG", compress_level=6)
+        jpeg = io.BytesIO()
+        img.convert("RGB").save(jpeg, format="JPEG", quality=self.jpeg_quality, optimize=True)
+        if jpeg.tell() < png.tell():
+            return ("image/jpeg", jpeg.getvalue())
+        return ("image/png", png.getvalue())
+
+    def _load(self, key):
+        manifest = os.path.join(self.cache_dir, f"prep_{key}.json")
+        try:
+            with open(manifest, encoding="utf-8") as f:
+                entries = json.load(f)
+            parts = []
+            for entry in entries:
+                with open(os.path.join(self.cache_dir, entry["file"]), "rb") as f:
+                    parts.append((entry["mime"], f.read()))
+            return parts
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _store(self, key, parts):
+        entries = []
+        for i, (mime, data) in enumerate(parts):
+            name = f"prep_{key}_{i}.{mime.split('/')[-1]}"
+            with open(os.path.join(self.cache_dir, name), "wb") as f:
+                f.write(data)
+            entries.append({"mime": mime, "file": name})
+        # Manifesto por último: só existe se todas as partes foram gravadas
+        with open(os.path.join(self.cache_dir, f"prep_{key}.json"), "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+
+
+def _flatten(img):
+    # Transparência sobre fundo branco (diagramas exportados com alpha)
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        return background
+    if img.mode not in ("RGB", "L"):
+        return img.convert("RGB")
+    return img
+
+
+def _fit(img, max_side):
+    width, height = img.size
+    if max(width, height) <= max_side:
+        return img
+    scale = max_side / max(width, height)
+    return img.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+
+def _tile_boxes(width, height, tile_side, max_tiles):
+    """
+    Grade de recortes com ~5% de sobreposição; se passar de max_tiles, os
+    recortes crescem (e depois são reduzidos) para caber no limite.
+    """
+    cols = math.ceil(width / tile_side)
+    rows = math.ceil(height / tile_side)
+    while cols * rows > max_tiles:
+        if cols >= rows:
+            cols -= 1
+        else:
+            rows -= 1
+    cols, rows = max(cols, 1), max(rows, 1)
+    tile_w, tile_h = math.ceil(width / cols), math.ceil(height / rows)
+    pad_w, pad_h = tile_w // 20, tile_h // 20
+    boxes = []
+    for r in range(rows):
+        for c in range(cols):
+            left, top = max(0, c * tile_w - pad_w), max(0, r * tile_h - pad_h)
+            right, bottom = min(width, (c + 1) * tile_w + pad_w), min(height, (r + 1) * tile_h + pad_h)
+            boxes.append((left, top, right, bottom))
+    return boxes
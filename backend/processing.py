@@ -1,10 +1,102 @@
 # processing.py
-import json, os, shutil, base64, re
+import json, os, shutil, base64, re, time, random, threading, logging, queue
 import openai
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import tempfile
+from cache import EnrichmentCache, make_key
+from image_cache import ImageIndex, sha256_file, dhash
+from preprocess import ImagePreprocessor, sniff_mime
+from graph import ThreatGraph
+from scheduler import EnrichmentBudget, component_priority, threat_priority, template_enrichment, enrichment_summary
+import metrics
+
+logger = logging.getLogger("stride.processing")
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# As novas tentativas ficam só em chat_completion (o SDK repetiria cada uma mais 2 vezes)
+openai.max_retries = 0
+
+# Enriquecimento concorrente (ajustável por variável de ambiente)
+ENRICH_MAX_WORKERS = int(os.getenv("ENRICH_MAX_WORKERS", "8"))
+ENRICH_TIMEOUT = float(os.getenv("ENRICH_TIMEOUT", "60"))
+ENRICH_MAX_RETRIES = int(os.getenv("ENRICH_MAX_RETRIES", "3"))
+ENRICH_BACKOFF = float(os.getenv("ENRICH_BACKOFF", "1.0"))
+
+# "batch": uma chamada por componente (ou grupo); "single": uma chamada por ameaça
+ENRICH_MODE = os.getenv("ENRICH_MODE", "batch")
+ENRICH_BATCH_COMPONENTS = int(os.getenv("ENRICH_BATCH_COMPONENTS", "1"))
+ENRICH_BATCH_MAX_TOKENS = int(os.getenv("ENRICH_BATCH_MAX_TOKENS", "16000"))
+
+# Orçamento por análise (0 = sem limite); ameaças que não couberem recebem texto de template
+ENRICH_BUDGET_TOKENS = int(os.getenv("ENRICH_BUDGET_TOKENS", "0"))
+ENRICH_BUDGET_SECONDS = float(os.getenv("ENRICH_BUDGET_SECONDS", "0"))
+ENRICH_TOKENS_PER_THREAT = int(os.getenv("ENRICH_TOKENS_PER_THREAT", "600"))
+
+# Erros transitórios que justificam nova tentativa
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, TimeoutError)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Cliente LLM usado nas chamadas; None usa o cliente global do módulo openai
+_llm_client = None
+
+def set_llm_client(client):
+    """
+    Substitui o cliente LLM (ex.: cliente falso em benchmarks). None restaura o padrão.
+    """
+    global _llm_client
+    _llm_client = client
+
+def get_llm_client():
+    return _llm_client if _llm_client is not None else openai
+
+# Métricas de LLM e cache (expostas em /metrics)
+LLM_REQUESTS = metrics.counter("llm_requests_total", "Chamadas ao LLM por tipo e resultado", ("kind", "outcome"))
+LLM_SECONDS = metrics.histogram("llm_request_duration_seconds", "Latência de cada chamada ao LLM", ("kind",))
+LLM_TOKENS = metrics.counter("llm_tokens_total", "Tokens consumidos no LLM", ("kind", "type"))
+LLM_RETRIES = metrics.counter("llm_retries_total", "Novas tentativas após erro transitório", ("kind",))
+LLM_PARSE_FAILURES = metrics.counter("llm_parse_failures_total", "Respostas do LLM que não eram JSON válido", ("kind",))
+ENRICH_CACHE = metrics.counter("enrich_cache_requests_total", "Consultas ao cache de enriquecimento", ("result",))
+ENRICH_THREATS = metrics.counter("enrich_threats_total", "Ameaças enriquecidas por origem do texto", ("source",))
+ENRICH_FALLBACKS = metrics.counter("enrich_batch_fallbacks_total", "Ameaças refeitas individualmente após falha no lote")
+IMAGE_CACHE = metrics.counter("image_analysis_cache_requests_total", "Reaproveitamento de análises de imagem", ("result",))
+
+# Chamadas simultâneas ao LLM no processo inteiro (o rate limit é por chave de API),
+# somando análises, streams, jobs e lotes; os pools de cada análise só esperam aqui
+_llm_slots = threading.BoundedSemaphore(max(1, ENRICH_MAX_WORKERS))
+
+def _llm_call(kind, **kwargs):
+    """
+    Uma chamada ao cliente LLM, medida (latência, tokens, resultado).
+    """
+    with _llm_slots:
+        start = time.perf_counter()
+        try:
+            response = get_llm_client().chat.completions.create(**kwargs)
+        except Exception:
+            LLM_REQUESTS.inc(kind=kind, outcome="error")
+            raise
+        finally:
+            LLM_SECONDS.observe(time.perf_counter() - start, kind=kind)
+    LLM_REQUESTS.inc(kind=kind, outcome="ok")
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, kind=kind, type="prompt")
+        LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, kind=kind, type="completion")
+    return response
+
+def new_budget(spent_tokens=0, analyses=1):
+    """
+    Orçamento de enriquecimento de uma análise, com os limites do ambiente.
+    spent_tokens desconta o que execuções anteriores da mesma análise já gastaram;
+    em lotes, o orçamento de tokens vale para cada um dos `analyses` diagramas.
+    """
+    return EnrichmentBudget(
+        max_tokens=ENRICH_BUDGET_TOKENS * analyses,
+        max_seconds=ENRICH_BUDGET_SECONDS,
+        tokens_per_threat=ENRICH_TOKENS_PER_THREAT,
+        spent_tokens=spent_tokens,
+    )
 
 TEMP_DIR = tempfile.gettempdir()
 DATA_DIR = os.path.join(TEMP_DIR, "data")
@@ -12,17 +104,106 @@ STATIC_DIR = os.path.join(TEMP_DIR, "static")
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(STATIC_DIR, exist_ok=True)
 
+ENRICH_MODEL = "gpt-4o-mini"
+
+# Cache persistente de enriquecimentos (SQLite + LRU em memória)
+ENRICH_CACHE_ENABLED = os.getenv("ENRICH_CACHE_ENABLED", "1") == "1"
+enrichment_cache = EnrichmentCache(
+    os.getenv("ENRICH_CACHE_PATH", os.path.join(DATA_DIR, "enrichment_cache.sqlite")),
+    ttl=float(os.getenv("ENRICH_CACHE_TTL", str(30 * 24 * 3600))),
+    max_entries=int(os.getenv("ENRICH_CACHE_MAX_ENTRIES", "100000")),
+    memory_entries=int(os.getenv("ENRICH_CACHE_MEMORY_ENTRIES", "2048")),
+) if ENRICH_CACHE_ENABLED else None
+
+# Reaproveitamento de análises de imagens repetidas
+IMAGE_DEDUP_ENABLED = os.getenv("IMAGE_DEDUP_ENABLED", "1") == "1"
+IMAGE_DEDUP_PHASH = os.getenv("IMAGE_DEDUP_PHASH", "0") == "1"
+IMAGE_PHASH_MAX_DISTANCE = int(os.getenv("IMAGE_PHASH_MAX_DISTANCE", "4"))
+image_index = ImageIndex(os.path.join(DATA_DIR, "image_index.sqlite")) if IMAGE_DEDUP_ENABLED else None
+
+# Pré-processamento da imagem antes da análise de visão
+IMAGE_PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS_ENABLED", "1") == "1"
+image_preprocessor = ImagePreprocessor(
+    DATA_DIR,
+    max_side=int(os.getenv("IMAGE_MAX_SIDE", "2048")),
+    tile_threshold=int(os.getenv("IMAGE_TILE_THRESHOLD", "4096")),
+    max_tiles=int(os.getenv("IMAGE_MAX_TILES", "0")),
+    jpeg_quality=int(os.getenv("IMAGE_JPEG_QUALITY", "85")),
+) if IMAGE_PREPROCESS_ENABLED else None
+
+def _image_parts(image_path, sha=None):
+    """
+    Partes (mime, bytes) a enviar ao modelo de visão.
+    """
+    if image_preprocessor is not None:
+        return image_preprocessor.prepare(image_path, sha=sha)
+    with open(image_path, "rb") as f:
+        raw = f.read()
+    return [(sniff_mime(raw), raw)]
+
+def _load_analysis(analysis_id):
+    try:
+        with open(os.path.join(DATA_DIR, f"{analysis_id}.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _find_previous_analysis(sha, phash):
+    """
+    Procura uma análise anterior da mesma imagem cujo JSON ainda exista em DATA_DIR.
+    """
+    max_distance = IMAGE_PHASH_MAX_DISTANCE if IMAGE_DEDUP_PHASH else 0
+    for previous_id in image_index.find(sha, phash, max_distance):
+        data = _load_analysis(previous_id)
+        if data is not None and not data.get("error"):
+            return previous_id, data
+        image_index.remove(previous_id)
+    return None, None
+
+def _save_analysis(data, image_path, analysis_id):
+    data["analysis_id"] = analysis_id
+    data["image_url"] = f"/static/{os.path.basename(image_path)}"
+
+    # Salvar JSON de análise
+    with open(os.path.join(DATA_DIR, f"{analysis_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+    # Expor a imagem na pasta estática (hardlink; cópia só se o link falhar)
+    _link_or_copy(image_path, os.path.join(STATIC_DIR, os.path.basename(image_path)))
+    return data
+
+def _link_or_copy(src, dst):
+    if os.path.exists(dst):
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
 # --------------------
 # Análise da imagem
 # --------------------
-def analyze_image(image_path, analysis_id=None):
+def analyze_image(image_path, analysis_id=None, use_cache=True):
     """
     Identifica os componentes do diagrama a partir da imagem.
     Retorna um JSON estruturado com components e graph.
+    Com use_cache=True, reaproveita a análise de uma imagem idêntica já processada.
     """
     try:
-        with open(image_path, "rb") as f:
-            img_b64 = base64.b64encode(f.read()).decode("utf-8")
+        sha = phash = None
+        if image_index is not None:
+            sha = sha256_file(image_path)
+            phash = dhash(image_path) if IMAGE_DEDUP_PHASH else None
+            if use_cache:
+                previous_id, previous = _find_previous_analysis(sha, phash)
+                IMAGE_CACHE.inc(result="hit" if previous is not None else "miss")
+                if previous is not None:
+                    previous["cached_from"] = previous_id
+                    data = _save_analysis(previous, image_path, analysis_id)
+                    image_index.add(analysis_id, sha, phash)
+                    return data
+
+        parts = _image_parts(image_path, sha)
 
         prompt = """
         Você é um especialista em arquitetura de software e segurança.
@@ -39,16 +220,23 @@ def analyze_image(image_path, analysis_id=None):
         }
         Se não souber a posição (bbox), coloque [0,0,0,0].
         """
+        if len(parts) > 1:
+            prompt += f"""
+        O diagrama foi enviado em {len(parts)} imagens: a primeira é a visão geral e as
+        demais são recortes ampliados (com sobreposição) para leitura dos rótulos.
+        Não duplique componentes que aparecem em mais de um recorte.
+        """
 
-        response = openai.chat.completions.create(
+        response = _llm_call(
+            "vision",
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "Você retorna sempre JSON válido."},
                 {
                     "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}"}}
+                    "content": [{"type": "text", "text": prompt}] + [
+                        {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"}}
+                        for mime, data in parts
                     ]
                 }
             ],
@@ -61,24 +249,20 @@ def analyze_image(image_path, analysis_id=None):
 
         try:
             data = json.loads(content_clean)
-        except:
+        except ValueError:
+            LLM_PARSE_FAILURES.inc(kind="vision")
+            logger.warning("Resposta da análise de imagem não é JSON válido (analysis_id=%s)", analysis_id)
             data = {"components": [], "graph": {"nodes": [], "edges": []}, "error": f"Falha no parse JSON: {content}"}
 
-        data["analysis_id"] = analysis_id
-        data["image_url"] = f"/static/{os.path.basename(image_path)}"
-
-        # Salvar JSON de análise
-        with open(os.path.join(DATA_DIR, f"{analysis_id}.json"), "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        data = _save_analysis(data, image_path, analysis_id)
 
-        # Copiar imagem para pasta estática temporária
-        shutil.copy(image_path, os.path.join(STATIC_DIR, os.path.basename(image_path)))
-
-        # Atualize a URL da imagem para refletir o novo caminho (se necessário)
-        data["image_url"] = f"/static/{os.path.basename(image_path)}"
+        # Só análises válidas entram no índice de deduplicação
+        if image_index is not None and analysis_id is not None and not data.get("error"):
+            image_index.add(analysis_id, sha, phash)
 
         return data
     except Exception as e:
+        logger.exception("Falha na análise da imagem (analysis_id=%s)", analysis_id)
         return {"analysis_id": analysis_id, "components": [], "graph": {"nodes": [], "edges": []}, "error": str(e)}
 
 # --------------------
@@ -93,6 +277,7 @@ STRIDE_MAP = {
     "storage": ["Information Disclosure", "Tampering", "Denial of Service"],
     "load_balancer": ["Denial of Service", "Tampering"],
     "identity_provider": ["Spoofing", "Repudiation", "Elevation of Privilege"],
+    "data_flow": ["Tampering", "Information Disclosure", "Denial of Service"],
     "default": ["Tampering", "Information Disclosure"]
 }
 
@@ -105,61 +290,274 @@ SEVERITY_MAP = {
     "Elevation of Privilege": "High"
 }
 
+# --------------------
+# Montagem das ameaças
+# --------------------
+def _stride_candidates(component):
+    typ = component.get("type", "default")
+    label = component.get("label", "Sem nome")
+    return typ, label, STRIDE_MAP.get(typ, STRIDE_MAP["default"])
+
+# Atributos do grafo repassados do componente para cada ameaça
+GRAPH_FIELDS = ("exposed", "hops_from_entry", "flow")
+
+def _build_threat(threat_type, label, enriched, component=None):
+    threat = {
+        "title": f"{threat_type} on {label}",
+        "component": label,
+        "threat_type": threat_type,
+        "severity": SEVERITY_MAP.get(threat_type, "Medium"),
+        "description": enriched["description"],
+        "mitigation": enriched["mitigation"]
+    }
+    for field in GRAPH_FIELDS:
+        if component and field in component:
+            threat[field] = component[field]
+    if "source" in enriched:
+        threat["enrichment"] = enriched["source"]
+    return threat
+
 # --------------------
 # Função STRIDE completa
 # --------------------
-def generate_stride_report(analysis):
-    threats = []
-    for comp in analysis.get("components", []):
-        typ = comp.get("type", "default")
-        label = comp.get("label", "Sem nome")
-        candidates = STRIDE_MAP.get(typ, STRIDE_MAP["default"])
-        for t in candidates:
-            enriched = enrich_with_openai(t, {"label": label, "type": typ})
-            threats.append({
-                "title": f"{t} on {label}",
-                "component": label,
-                "threat_type": t,
-                "severity": SEVERITY_MAP.get(t, "Medium"),
-                "description": enriched["description"],
-                "mitigation": enriched["mitigation"]
-            })
+def generate_stride_report(analysis, max_workers=None):
+    components = analysis.get("components", [])
+    graph = ThreatGraph(components, analysis.get("graph", {}).get("edges"))
+    usage = LLMUsage()
+    budget = new_budget()
+
+    # Componentes e fluxos de fronteira; o LLM recebe as ameaças em ordem de prioridade
+    units = graph.stride_units()
+    enriched = enrich_components(units, max_workers=max_workers, usage=usage, budget=budget)
+    threats = _assemble_threats(graph, units, {u["id"]: e for u, e in zip(units, enriched)})
     return {
         "analysis_id": analysis.get("analysis_id"),
-        "components_count": len(analysis.get("components", [])),
+        "components_count": len(components),
         "threats": threats,
-        "graph": analysis.get("graph", {})
+        "graph": graph.summary(),
+        "usage": usage.as_dict(),
+        "enrichment": {**enrichment_summary(threats), "budget": budget.as_dict()}
     }
 
+def _assemble_threats(graph, units, enriched_by_id):
+    """
+    Ameaças em ordem determinística: componentes na ordem original, depois fluxos.
+    """
+    by_id = {u["id"]: (u, enriched_by_id[u["id"]]) for u in units}
+    threats = []
+    for unit_id in list(graph.nodes) + [u["id"] for u in units if u["id"] not in graph.nodes]:
+        unit, unit_results = by_id[unit_id]
+        _, label, candidates = _stride_candidates(unit)
+        threats.extend(_build_threat(t, label, e, unit) for t, e in zip(candidates, unit_results))
+    return threats
+
 # --------------------
-# STRIDE incremental
+# STRIDE em lote (vários diagramas)
 # --------------------
-def generate_stride_for_component(component, analysis_id=None):
-    typ = component.get("type", "default")
-    label = component.get("label", "Sem nome")
-    candidates = STRIDE_MAP.get(typ, STRIDE_MAP["default"])
-    threats = []
-    for t in candidates:
-        enriched = enrich_with_openai(t, {"label": label, "type": typ})
-        threats.append({
-            "title": f"{t} on {label}",
-            "component": label,
-            "threat_type": t,
-            "severity": SEVERITY_MAP.get(t, "Medium"),
-            "description": enriched["description"],
-            "mitigation": enriched["mitigation"]
+def dedup_key(component):
+    """
+    Componentes com o mesmo tipo e rótulo (sem diferenciar maiúsculas e
+    espaços) recebem o mesmo enriquecimento, em qualquer diagrama.
+    """
+    typ, label, _ = _stride_candidates(component)
+    return typ, " ".join(str(label).split()).casefold()
+
+def generate_stride_batch(analyses, max_workers=None, executor=None):
+    """
+    STRIDE de vários diagramas ({"analysis_id", "components", "graph"}) com
+    enriquecimento deduplicado: cada (tipo, rótulo, ameaça) distinto vai ao
+    LLM uma vez só, numa única rodada limitada a max_workers (ou ao tamanho
+    de `executor`, se for passado um pool compartilhado). Retorna os
+    relatórios por diagrama (formato de generate_stride_report), o uso de
+    LLM e os contadores de deduplicação.
+    """
+    usage = LLMUsage()
+    graphs = [ThreatGraph(a.get("components", []), (a.get("graph") or {}).get("edges")) for a in analyses]
+    units_per = [g.stride_units() for g in graphs]
+
+    # Representante de cada chave: a ocorrência mais crítica define a prioridade
+    unique = {}
+    for units in units_per:
+        for unit in units:
+            key = dedup_key(unit)
+            if key not in unique or component_priority(unit) > component_priority(unique[key]):
+                unique[key] = unit
+    budget = new_budget(analyses=max(1, len(analyses)))
+    enriched = dict(zip(unique, enrich_components(
+        list(unique.values()), max_workers=max_workers, usage=usage, budget=budget, executor=executor,
+    )))
+
+    reports = []
+    for analysis, graph, units in zip(analyses, graphs, units_per):
+        threats = _assemble_threats(graph, units, {u["id"]: enriched[dedup_key(u)] for u in units})
+        reports.append({
+            "analysis_id": analysis.get("analysis_id"),
+            "components_count": len(graph.nodes),
+            "threats": threats,
+            "graph": graph.summary(),
+            "enrichment": enrichment_summary(threats),
         })
-    return {"analysis_id": analysis_id, "component": label, "threats": threats}
+    return {
+        "reports": reports,
+        "usage": usage.as_dict(),
+        "budget": budget.as_dict(),
+        "dedup": {
+            "units": sum(len(units) for units in units_per),
+            "unique_units": len(unique),
+            "threats": sum(len(r["threats"]) for r in reports),
+            "unique_threats": sum(len(_stride_candidates(u)[2]) for u in unique.values()),
+        },
+    }
+
+# --------------------
+# STRIDE incremental
+# --------------------
+def _component_result(component, analysis_id, enriched, usage):
+    _, label, candidates = _stride_candidates(component)
+    threats = [_build_threat(t, label, e, component) for t, e in zip(candidates, enriched)]
+    return {
+        "analysis_id": analysis_id,
+        "component": label,
+        "component_id": component.get("id"),
+        "threats": threats,
+        "usage": usage,
+        "enrichment": enrichment_summary(threats)
+    }
+
+def generate_stride_for_component(component, analysis_id=None, max_workers=None, budget=None):
+    usage = LLMUsage()
+    enriched = enrich_components([component], max_workers=max_workers, usage=usage, budget=budget)[0]
+    return _component_result(component, analysis_id, enriched, usage.as_dict())
+
+def iter_stride_components(components, analysis_id=None, max_workers=None, budget=None):
+    """
+    Gera o STRIDE dos componentes numa única passada de enriquecimento (as
+    ameaças de todos em ordem de prioridade, dividindo o mesmo orçamento) e
+    entrega o resultado de cada componente (formato de
+    generate_stride_for_component) assim que todas as suas ameaças ficam
+    prontas. O "usage" de cada resultado é o gasto desde o anterior, então a
+    soma dos resultados dá o total da passada.
+    """
+    components = sorted(components, key=component_priority, reverse=True)
+    if not components:
+        return
+    budget = budget or new_budget()
+    usage = LLMUsage()
+    ready = queue.Queue()
+
+    def run():
+        try:
+            enrich_components(components, max_workers=max_workers, usage=usage, budget=budget,
+                              on_component=lambda i, enriched: ready.put((i, enriched)))
+            ready.put(None)
+        except BaseException as e:
+            ready.put(e)
+
+    threading.Thread(target=run, name="stride", daemon=True).start()
+    reported = merge_usage([])
+    while True:
+        item = ready.get()
+        if item is None:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        i, enriched = item
+        current = usage.as_dict()
+        delta = {k: current[k] - reported[k] for k in reported}
+        reported = current
+        yield _component_result(components[i], analysis_id, enriched, delta)
 
 # --------------------
 # Enriquecimento com OpenAI
 # --------------------
-def enrich_with_openai(threat_type, component):
+class LLMUsage:
     """
-    Retorna description e mitigation de forma robusta.
+    Contadores de requisições e tokens de uma análise (seguro entre threads).
     """
-    prompt = f"""
-    Você é um especialista em segurança de sistemas. Para o componente "{component.get('label')}" (tipo={component.get('type')}), 
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.fallbacks = 0
+
+    def record(self, response):
+        usage = getattr(response, "usage", None)
+        with self._lock:
+            self.requests += 1
+            if usage is not None:
+                self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+                self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def add_fallbacks(self, n):
+        with self._lock:
+            self.fallbacks += n
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "fallbacks": self.fallbacks
+            }
+
+def merge_usage(usages):
+    """
+    Soma dicionários de uso (LLMUsage.as_dict) de várias execuções.
+    """
+    total = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "fallbacks": 0}
+    for u in usages:
+        for k in total:
+            total[k] += (u or {}).get(k, 0)
+    return total
+
+def _is_retryable(exc):
+    if isinstance(exc, RETRYABLE_ERRORS):
+        return True
+    return getattr(exc, "status_code", None) in RETRYABLE_STATUS
+
+def _response_tokens(response):
+    usage = getattr(response, "usage", None)
+    return (getattr(usage, "total_tokens", 0) or 0) if usage is not None else 0
+
+def chat_completion(usage=None, budget=None, kind="enrich", **kwargs):
+    """
+    Chamada ao LLM com timeout por requisição e novas tentativas com backoff
+    exponencial (com jitter) para rate limit e falhas transitórias. Com
+    budget, o timeout não passa do prazo da análise e os tokens são cobrados.
+    """
+    kwargs.setdefault("timeout", budget.timeout(ENRICH_TIMEOUT) if budget is not None else ENRICH_TIMEOUT)
+    attempt = 0
+    while True:
+        try:
+            response = _llm_call(kind, **kwargs)
+            if usage is not None:
+                usage.record(response)
+            if budget is not None:
+                budget.charge(_response_tokens(response))
+            return response
+        except Exception as e:
+            if attempt >= ENRICH_MAX_RETRIES or not _is_retryable(e):
+                raise
+            if budget is not None and budget.expired():
+                raise
+            delay = ENRICH_BACKOFF * (2 ** attempt)
+            LLM_RETRIES.inc(kind=kind)
+            logger.warning("Erro transitório no LLM (%s): %s; nova tentativa em %.1fs", kind, e, delay)
+            time.sleep(delay + random.uniform(0, delay / 2))
+            attempt += 1
+
+def _parse_json_content(response):
+    text = response.choices[0].message.content.strip()
+    text_clean = re.sub(r"^```(json)?\n","", text)
+    text_clean = re.sub(r"\n```$","", text_clean)
+    return json.loads(text_clean)
+
+ENRICH_PROMPT = """
+    Você é um especialista em segurança de sistemas. Para o componente "{label}" (tipo={type}), 
     descreva o risco da ameaça "{threat_type}" e indique estratégias de mitigação. 
     Retorne a resposta **somente** em JSON válido no seguinte formato:
 
@@ -170,16 +568,322 @@ def enrich_with_openai(threat_type, component):
 
     Seja conciso mas completo.
     """
+
+def enrichment_key(threat_type, component):
+    return make_key(ENRICH_MODEL, ENRICH_PROMPT, threat_type, component.get("label"), component.get("type"))
+
+def _cache_get(threat_type, component):
+    if enrichment_cache is None:
+        return None
+    cached = enrichment_cache.get(enrichment_key(threat_type, component))
+    ENRICH_CACHE.inc(result="hit" if cached is not None else "miss")
+    return dict(cached) if cached is not None else None
+
+def _cache_set(threat_type, component, result):
+    # Só resultados válidos vão para o cache
+    if enrichment_cache is not None:
+        enrichment_cache.set(enrichment_key(threat_type, component), result)
+
+# Texto das ameaças cujo enriquecimento falhou
+UNAVAILABLE = {"description": "Descrição não disponível", "mitigation": "Mitigação não disponível"}
+
+def _enrich_single(threat_type, component, usage=None, budget=None):
+    """
+    Enriquece uma ameaça; retorna (enriquecimento, origem), com origem
+    cache, llm ou failed. A reserva no orçamento fica com quem chama.
+    """
+    cached = _cache_get(threat_type, component)
+    if cached is not None:
+        return cached, "cache"
+
+    prompt = ENRICH_PROMPT.format(label=component.get("label"), type=component.get("type"), threat_type=threat_type)
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role":"user","content":prompt}],
-            max_tokens=4000
-        )
-        text = response.choices[0].message.content.strip()
-        text_clean = re.sub(r"^```(json)?\n","", text)
-        text_clean = re.sub(r"\n```$","", text_clean)
-        data = json.loads(text_clean)
-        return {"description": data.get("description","").strip(), "mitigation": data.get("mitigation","").strip()}
-    except:
-        return {"description":"Descrição não disponível","mitigation":"Mitigação não disponível"}
+        with metrics.span("enrich", logging.DEBUG, threat_type=threat_type, component_type=component.get("type")):
+            response = chat_completion(
+                usage=usage,
+                budget=budget,
+                model=ENRICH_MODEL,
+                messages=[{"role":"user","content":prompt}],
+                max_tokens=4000
+            )
+    except Exception as e:
+        logger.warning("Falha no enriquecimento de %s em '%s': %s", threat_type, component.get("label"), e)
+        return dict(UNAVAILABLE), "failed"
+    try:
+        data = _parse_json_content(response)
+        result = {"description": data.get("description","").strip(), "mitigation": data.get("mitigation","").strip()}
+    except (ValueError, AttributeError, IndexError, TypeError) as e:
+        # Resposta fora do formato esperado (JSON inválido ou sem os campos)
+        LLM_PARSE_FAILURES.inc(kind="enrich")
+        logger.warning("Resposta inválida no enriquecimento de %s em '%s': %s", threat_type, component.get("label"), e)
+        return dict(UNAVAILABLE), "failed"
+
+    _cache_set(threat_type, component, result)
+    return result, "llm"
+
+def enrich_with_openai(threat_type, component, usage=None, budget=None):
+    """
+    Retorna description e mitigation de forma robusta.
+    """
+    return _enrich_single(threat_type, component, usage, budget)[0]
+
+def _parallel_map(fn, items, max_workers=None, executor=None):
+    # Mantém a ordem de `items`; as primeiras entradas são submetidas primeiro.
+    # Com `executor`, usa esse pool (compartilhado) em vez de criar um próprio.
+    if executor is not None:
+        return list(executor.map(fn, items))
+    workers = max(1, min(max_workers or ENRICH_MAX_WORKERS, len(items)))
+    if workers == 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrich") as pool:
+        return list(pool.map(fn, items))
+
+def _run_in_rounds(groups, run, budget=None, max_workers=None, executor=None):
+    """
+    Executa run(grupo) para grupos de ameaças [(i, threat_type), ...] em
+    ordem de prioridade; cada run devolve {(i, threat_type): enriquecimento}.
+    Retorna (resultados, ameaças que não couberam no orçamento).
+
+    A admissão é sequencial, na ordem dos grupos: o orçamento é reservado
+    grupo a grupo e para no primeiro que não couber inteiro (o início dele
+    ainda entra). Só as chamadas admitidas rodam em paralelo; terminada a
+    rodada, o gasto real já foi cobrado e a próxima admite o que passou a
+    caber. Assim um grupo de menor prioridade nunca passa à frente de um
+    maior que ainda espera orçamento.
+    """
+    results, denied, pending = {}, [], [list(g) for g in groups if g]
+    while pending:
+        admitted = []
+        for k, group in enumerate(pending):
+            granted, reserved = budget.reserve(len(group)) if budget is not None else (len(group), 0)
+            if granted:
+                admitted.append((group[:granted], reserved))
+            if granted < len(group):
+                pending = [group[granted:]] + pending[k + 1:]
+                break
+        else:
+            pending = []
+        if not admitted:
+            break
+
+        def run_admitted(item):
+            group, reserved = item
+            try:
+                if budget is not None and budget.expired():
+                    return {}, group  # o prazo acabou enquanto o grupo esperava um worker
+                return run(group), []
+            finally:
+                if budget is not None:
+                    budget.release(reserved)
+
+        for done, late in _parallel_map(run_admitted, admitted, max_workers, executor):
+            results.update(done)
+            denied.extend(late)
+    return results, denied + [it for group in pending for it in group]
+
+# --------------------
+# Enriquecimento em lote (todas as ameaças de um ou mais componentes por chamada)
+# --------------------
+ENRICH_BATCH_PROMPT = """
+    Você é um especialista em segurança de sistemas. Para cada componente listado
+    entre <componentes> e </componentes>, descreva o risco de cada ameaça indicada
+    em "threats" e as estratégias de mitigação.
+
+    <componentes>
+    {items}
+    </componentes>
+
+    Retorne a resposta **somente** em JSON válido no seguinte formato:
+
+    {{
+      "components": [
+        {{
+          "id": "id do componente",
+          "threats": [
+            {{"threat_type": "nome da ameaça", "description": "Descrição detalhada do risco da ameaça.", "mitigation": "Estratégias práticas de mitigação."}}
+          ]
+        }}
+      ]
+    }}
+
+    Inclua todas as ameaças pedidas e nenhuma outra. Seja conciso mas completo.
+    """
+
+def _valid_enrichment(entry):
+    if not isinstance(entry, dict):
+        return None
+    description, mitigation = entry.get("description"), entry.get("mitigation")
+    if not isinstance(description, str) or not isinstance(mitigation, str):
+        return None
+    if not description.strip() or not mitigation.strip():
+        return None
+    return {"description": description.strip(), "mitigation": mitigation.strip()}
+
+def enrich_batch(items, usage=None, budget=None):
+    """
+    Enriquece em uma única chamada uma lista de (component, [threat_types]).
+    Retorna {(índice do item, threat_type): enriquecimento} apenas para as
+    ameaças que vieram válidas na resposta; as demais ficam de fora.
+    Retorna None se a chamada falhar (erro de transporte após as novas
+    tentativas): não há resposta a aproveitar nem a refazer por ameaça.
+    """
+    payload = [
+        {"id": f"c{i}", "label": comp.get("label"), "type": comp.get("type"), "threats": list(types)}
+        for i, (comp, types) in enumerate(items)
+    ]
+    n_threats = sum(len(p["threats"]) for p in payload)
+    prompt = ENRICH_BATCH_PROMPT.format(items=json.dumps(payload, ensure_ascii=False))
+    try:
+        with metrics.span("enrich_batch", logging.DEBUG, components=len(payload), threats=n_threats):
+            response = chat_completion(
+                usage=usage,
+                budget=budget,
+                kind="enrich_batch",
+                model=ENRICH_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=min(ENRICH_BATCH_MAX_TOKENS, 1000 * n_threats),
+                response_format={"type": "json_object"}
+            )
+    except Exception as e:
+        logger.warning("Falha no enriquecimento em lote (%d ameaças): %s", n_threats, e)
+        return None
+    try:
+        data = _parse_json_content(response)
+    except (ValueError, AttributeError, IndexError, TypeError) as e:
+        LLM_PARSE_FAILURES.inc(kind="enrich_batch")
+        logger.warning("Resposta inválida no enriquecimento em lote (%d ameaças): %s", n_threats, e)
+        return {}
+
+    results = {}
+    index = {p["id"]: i for i, p in enumerate(payload)}
+    for comp_entry in data.get("components", []) if isinstance(data, dict) else []:
+        if not isinstance(comp_entry, dict) or comp_entry.get("id") not in index:
+            continue
+        i = index[comp_entry["id"]]
+        requested = set(payload[i]["threats"])
+        for entry in comp_entry.get("threats") or []:
+            enriched = _valid_enrichment(entry)
+            threat_type = entry.get("threat_type") if isinstance(entry, dict) else None
+            if enriched is not None and threat_type in requested:
+                results[(i, threat_type)] = enriched
+    return results
+
+def _batch_groups(pending, split_severity):
+    """
+    Agrupa as ameaças pendentes (já em ordem de prioridade) por componente,
+    na ordem em que cada grupo aparece. Com split_severity, as ameaças High
+    e Medium do mesmo componente vão em grupos separados, para que o
+    orçamento alcance as High de outros componentes antes das Medium.
+    """
+    groups = {}
+    for i, t in pending:
+        key = (i, SEVERITY_MAP.get(t, "Medium")) if split_severity else i
+        groups.setdefault(key, (i, []))[1].append(t)
+    return list(groups.values())
+
+def enrich_components(components, max_workers=None, usage=None, mode=None, budget=None, executor=None,
+                      on_component=None):
+    """
+    Enriquece todas as ameaças STRIDE de cada componente. Retorna, para cada
+    componente, a lista de enriquecimentos na ordem de STRIDE_MAP, cada um
+    com "source" (cache, llm, template ou failed).
+
+    As ameaças fora do cache vão ao LLM em ordem de prioridade (severidade e
+    criticidade do componente). Com budget limitado, as que não couberem no
+    orçamento de tokens/tempo recebem texto de template.
+
+    mode="batch" agrupa as ameaças (de até ENRICH_BATCH_COMPONENTS componentes)
+    em uma chamada e refaz individualmente só as que falharem no parse ou na
+    validação; se a chamada do lote falhar, suas ameaças ficam como failed.
+    mode="single" faz uma chamada por ameaça.
+
+    As chamadas rodam em `executor`, se informado; senão num pool próprio de
+    até max_workers threads. on_component(i, enriquecimentos) é chamado (de
+    qualquer thread) assim que todas as ameaças do componente i ficam prontas.
+    """
+    mode = mode or ENRICH_MODE
+    items = []
+    for comp in components:
+        typ, label, candidates = _stride_candidates(comp)
+        items.append(({"label": label, "type": typ}, candidates))
+
+    results = {}
+    remaining = [len(candidates) for _, candidates in items]
+    lock = threading.Lock()
+
+    def finish(done):
+        # Resultados finais: entrega cada componente que ficou completo
+        completed = []
+        with lock:
+            for (i, t), enriched in done.items():
+                results[(i, t)] = enriched
+                remaining[i] -= 1
+                if not remaining[i]:
+                    completed.append((i, [results[(i, c)] for c in items[i][1]]))
+        if on_component is not None:
+            for i, enriched in completed:
+                on_component(i, enriched)
+        return done
+
+    # Cache primeiro (não consome orçamento); o resto em ordem de prioridade
+    cached_results = {}
+    pending = []
+    for i, (comp, candidates) in enumerate(items):
+        for t in candidates:
+            cached = _cache_get(t, comp)
+            if cached is not None:
+                cached_results[(i, t)] = dict(cached, source="cache")
+            else:
+                pending.append((i, t))
+    finish(cached_results)
+    pending.sort(key=lambda it: threat_priority(SEVERITY_MAP.get(it[1], "Medium"), components[it[0]]), reverse=True)
+
+    def run_batch(group):
+        by_component = {}
+        for i, t in group:
+            by_component.setdefault(i, []).append(t)
+        admitted = list(by_component.items())
+        batch = enrich_batch([(items[i][0], types) for i, types in admitted], usage=usage, budget=budget)
+        if batch is None:
+            # Falha de transporte: refazer por ameaça multiplicaria as chamadas (ex.: em rate limit)
+            return finish({it: dict(UNAVAILABLE, source="failed") for it in group})
+        done = {}
+        for (j, t), enriched in batch.items():
+            i = admitted[j][0]
+            _cache_set(t, items[i][0], enriched)
+            done[(i, t)] = dict(enriched, source="llm")
+        return finish(done)
+
+    def run_single(group):
+        (i, t), = group
+        enriched, source = _enrich_single(t, items[i][0], usage, budget)
+        return finish({(i, t): dict(enriched, source=source)})
+
+    denied = []
+    failed = pending
+    if mode == "batch" and pending:
+        size = max(1, ENRICH_BATCH_COMPONENTS)
+        groups = _batch_groups(pending, split_severity=budget is not None and budget.limited)
+        chunks = [[(i, t) for i, types in groups[k:k + size] for t in types] for k in range(0, len(groups), size)]
+        _, denied = _run_in_rounds(chunks, run_batch, budget, max_workers, executor)
+
+        # Fallback individual para o que não veio válido no lote
+        not_admitted = set(denied)
+        failed = [it for it in pending if it not in results and it not in not_admitted]
+        if failed:
+            ENRICH_FALLBACKS.inc(len(failed))
+            if usage is not None:
+                usage.add_fallbacks(len(failed))
+
+    if failed:
+        _, not_admitted = _run_in_rounds([[it] for it in failed], run_single, budget, max_workers, executor)
+        denied += not_admitted
+
+    # O que não coube no orçamento (as ameaças de menor prioridade) recebe texto de template
+    if denied and budget is not None:
+        budget.deny(len(denied))
+    finish({(i, t): dict(template_enrichment(t, items[i][0]), source="template") for i, t in denied})
+
+    for enriched in results.values():
+        ENRICH_THREATS.inc(source=enriched["source"])
+    return [[results[(i, t)] for t in candidates] for i, (_, candidates) in enumerate(items)]
@@ -0,0 +1,256 @@
+# report_pdf.py
+from collections import Counter, defaultdict
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+# Estilos compilados uma vez e compartilhados por todas as renderizações
+STYLES = getSampleStyleSheet()
+THREAT_TABLE_STYLE = TableStyle([
+    ("BACKGROUND", (0,0), (-1,0), colors.grey),
+    ("TEXTCOLOR", (0,0), (-1,0), colors.whitesmoke),
+    ("ALIGN", (0,0), (-1,-1), "LEFT"),
+    ("VALIGN", (0,0), (-1,-1), "TOP"),
+    ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
+    ("FONTSIZE", (0,0), (-1,0), 10),
+    ("BOTTOMPADDING", (0,0), (-1,0), 8),
+    ("BACKGROUND", (0,1), (-1,-1), colors.beige),
+    ("GRID", (0,0), (-1,-1), 0.5, colors.black),
+])
+SUMMARY_TABLE_STYLE = TableStyle([
+    ("BACKGROUND", (0,0), (-1,0), colors.grey),
+    ("TEXTCOLOR", (0,0), (-1,0), colors.whitesmoke),
+    ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
+    ("GRID", (0,0), (-1,-1), 0.5, colors.black),
+])
+THREAT_HEADER = ["Tipo", "Descrição", "Mitigação"]
+PDF_MODES = ("full", "fast", "summary")
+
+
+def _group_by_component(threats):
+    # Relatórios consolidados (lote) trazem o diagrama de origem de cada ameaça
+    grouped = defaultdict(list)
+    for t in threats:
+        component = t.get("component", "Sem nome")
+        grouped[f"{t['diagram']} / {component}" if t.get("diagram") else component].append(t)
+    return grouped
+
+
+def _p(text, style="Normal"):
+    # Texto do LLM pode conter <, > e &: escapar antes do parser de markup
+    return Paragraph(escape(str(text)), STYLES[style])
+
+
+def _header(analysis_id, threats, grouped):
+    return [
+        _p(f"Relatório STRIDE - Análise {analysis_id}", "Title"),
+        Spacer(1, 12),
+        _p(f"Total de componentes: {len(grouped)}"),
+        _p(f"Total de ameaças: {len(threats)}"),
+        Spacer(1, 12),
+    ]
+
+
+# --------------------
+# Completo (tabelas por componente)
+# --------------------
+def build_pdf_report(report, analysis_id, pdf_path):
+    doc = SimpleDocTemplate(pdf_path, pagesize=letter)
+    threats = report.get("threats", [])
+    grouped = _group_by_component(threats)
+    elements = _header(analysis_id, threats, grouped)
+
+    # Tabelas por componente
+    if grouped:
+        for comp_name, comp_threats in grouped.items():
+            elements.append(_p(f"Componente: {comp_name}", "Heading2"))
+            data = [THREAT_HEADER]
+            for idx, t in enumerate(comp_threats, start=1):
+                data.append([
+                    _p(f"{idx}. {t.get('threat_type', '-')}"),
+                    _p(t.get("description", "-")),
+                    _p(t.get("mitigation", "-")),
+                ])
+            table = Table(data, colWidths=[100, "*", 150], repeatRows=1)
+            table.setStyle(THREAT_TABLE_STYLE)
+            elements.append(table)
+            elements.append(Spacer(1, 12))
+    else:
+        elements.append(_p("Nenhuma ameaça detectada."))
+
+    doc.build(elements)
+
+
+# --------------------
+# Resumo (contagens por componente e severidade)
+# --------------------
+def build_pdf_summary(report, analysis_id, pdf_path):
+    doc = SimpleDocTemplate(pdf_path, pagesize=letter)
+    threats = report.get("threats", [])
+    grouped = _group_by_component(threats)
+    elements = _header(analysis_id, threats, grouped)
+
+    by_type = Counter(t.get("threat_type", "-") for t in threats)
+    data = [["Tipo de ameaça", "Quantidade"]] + [[k, v] for k, v in by_type.most_common()]
+    elements += [_p("Ameaças por tipo", "Heading2"), Table(data, style=SUMMARY_TABLE_STYLE), Spacer(1, 12)]
+
+    data = [["Componente", "High", "Medium", "Low", "Total"]]
+    for comp_name, comp_threats in grouped.items():
+        sev = Counter(t.get("severity", "Medium") for t in comp_threats)
+        data.append([_p(comp_name), sev["High"], sev["Medium"], sev["Low"], len(comp_threats)])
+    if len(data) > 1:
+        elements += [
+            _p("Ameaças por componente", "Heading2"),
+            Table(data, colWidths=["*", 50, 55, 40, 45], style=SUMMARY_TABLE_STYLE, repeatRows=1),
+        ]
+    else:
+        elements.append(_p("Nenhuma ameaça detectada."))
+
+    doc.build(elements)
+
+
+# --------------------
+# Rápido (desenho direto no canvas, página a página)
+# --------------------
+_word_widths = {}
+
+def _split_word(word, font, size, max_width):
+    """
+    Parte uma palavra mais larga que a linha (ex.: URL ou token longo do LLM)
+    em pedaços que cabem; retorna [(pedaço, largura)].
+    """
+    pieces, piece, width = [], "", 0.0
+    for ch in word:
+        w = stringWidth(ch, font, size)
+        if piece and width + w > max_width:
+            pieces.append((piece, width))
+            piece, width = "", 0.0
+        piece += ch
+        width += w
+    pieces.append((piece, width))
+    return pieces
+
+def _wrap(text, font, size, max_width):
+    """
+    Quebra de linha por palavras com largura de cada palavra em cache:
+    relatórios grandes repetem muito vocabulário. Palavras mais largas que
+    a linha são quebradas no meio.
+    """
+    if len(_word_widths) > 200_000:
+        _word_widths.clear()
+    space = stringWidth(" ", font, size)
+    lines = []
+    for paragraph in text.split("\n"):
+        line, width = [], 0.0
+        for word in paragraph.split():
+            key = (word, font, size)
+            w = _word_widths.get(key)
+            if w is None:
+                w = _word_widths[key] = stringWidth(word, font, size)
+            if w > max_width:
+                if line:
+                    lines.append(" ".join(line))
+                pieces = _split_word(word, font, size, max_width)
+                lines.extend(piece for piece, _ in pieces[:-1])
+                line, width = [pieces[-1][0]], pieces[-1][1]
+                continue
+            extra = w + (space if line else 0)
+            if line and width + extra > max_width:
+                lines.append(" ".join(line))
+                line, width = [word], w
+            else:
+                line.append(word)
+                width += extra
+        lines.append(" ".join(line))
+    return lines
+
+class _PageWriter:
+    """
+    Escreve linhas diretamente no canvas, quebrando texto e páginas sem
+    montar flowables: custo linear, sem a lista de flowables nem o layout do
+    platypus. O canvas do ReportLab ainda guarda todas as páginas até o
+    save(), então a memória cresce com o tamanho do relatório.
+    """
+
+    def __init__(self, c, margin=54):
+        self.c = c
+        self.width, self.height = letter
+        self.margin = margin
+        self.text_width = self.width - 2 * margin
+        self.page = 1
+        self.y = self.height - margin
+
+    def _ensure(self, needed):
+        if self.y - needed < self.margin:
+            self._footer()
+            self.c.showPage()
+            self.page += 1
+            self.y = self.height - self.margin
+
+    def _footer(self):
+        self.c.setFont("Helvetica", 8)
+        self.c.drawRightString(self.width - self.margin, self.margin / 2, f"Página {self.page}")
+
+    def text(self, text, font="Helvetica", size=9, indent=0, leading=None, space_after=0):
+        leading = leading or size * 1.25
+        lines = _wrap(str(text), font, size, self.text_width - indent)
+        while lines:
+            self._ensure(leading)
+            # Um objeto de texto por trecho que cabe na página corrente
+            fits = max(1, int((self.y - self.margin) // leading))
+            chunk, lines = lines[:fits], lines[fits:]
+            obj = self.c.beginText(self.margin + indent, self.y - leading)
+            obj.setFont(font, size, leading)
+            for line in chunk:
+                obj.textLine(line)
+            self.c.drawText(obj)
+            self.y -= leading * len(chunk)
+        self.y -= space_after
+
+    def rule(self):
+        self._ensure(6)
+        self.y -= 3
+        self.c.setStrokeColor(colors.grey)
+        self.c.line(self.margin, self.y, self.width - self.margin, self.y)
+        self.y -= 3
+
+    def finish(self):
+        self._footer()
+        self.c.save()
+
+
+def build_pdf_report_fast(report, analysis_id, pdf_path):
+    threats = report.get("threats", [])
+    grouped = _group_by_component(threats)
+    w = _PageWriter(canvas.Canvas(pdf_path, pagesize=letter, pageCompression=1))
+
+    w.text(f"Relatório STRIDE - Análise {analysis_id}", "Helvetica-Bold", 16, space_after=8)
+    w.text(f"Total de componentes: {len(grouped)}", space_after=2)
+    w.text(f"Total de ameaças: {len(threats)}", space_after=10)
+
+    if not grouped:
+        w.text("Nenhuma ameaça detectada.")
+    for comp_name, comp_threats in grouped.items():
+        w.text(f"Componente: {comp_name}", "Helvetica-Bold", 12, space_after=4)
+        for idx, t in enumerate(comp_threats, start=1):
+            w.text(f"{idx}. {t.get('threat_type', '-')} ({t.get('severity', '-')})", "Helvetica-Bold", 9)
+            w.text(f"Descrição: {t.get('description', '-')}", indent=12)
+            w.text(f"Mitigação: {t.get('mitigation', '-')}", indent=12, space_after=4)
+        w.rule()
+    w.finish()
+
+
+def render_pdf(report, analysis_id, pdf_path, mode="full"):
+    """
+    Gera o PDF no modo pedido: full (tabelas), fast (canvas direto) ou summary.
+    """
+    if mode == "fast":
+        return build_pdf_report_fast(report, analysis_id, pdf_path)
+    if mode == "summary":
+        return build_pdf_summary(report, analysis_id, pdf_path)
+    return build_pdf_report(report, analysis_id, pdf_path)
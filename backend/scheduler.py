@@ -0,0 +1,162 @@
+# scheduler.py
+import threading, time
+
+# Peso da severidade e criticidade por tipo de componente (tipos desconhecidos: 1)
+SEVERITY_RANK = {"High": 2, "Medium": 1, "Low": 0}
+CRITICALITY = {
+    "database": 3,
+    "storage": 3,
+    "identity_provider": 3,
+    "api_gateway": 2,
+    "web_server": 2,
+    "service": 2,
+    "data_flow": 2,
+    "load_balancer": 1,
+    "user": 1,
+}
+
+# Texto genérico usado quando o orçamento acaba antes de chegar na ameaça
+THREAT_TEMPLATES = {
+    "Spoofing": (
+        "Um atacante pode se passar por {label} ou por quem se comunica com ele, usando credenciais ou identidades forjadas.",
+        "Exigir autenticação forte (MFA, mTLS ou tokens assinados) e validar a identidade em cada chamada.",
+    ),
+    "Tampering": (
+        "Dados processados ou trafegados por {label} podem ser alterados sem autorização.",
+        "Validar entradas, usar TLS em trânsito e verificar integridade (assinaturas, checksums) dos dados.",
+    ),
+    "Repudiation": (
+        "Ações executadas em {label} podem ser negadas por falta de registros confiáveis.",
+        "Manter logs de auditoria centralizados, imutáveis e com identificação do autor de cada ação.",
+    ),
+    "Information Disclosure": (
+        "Informações sensíveis mantidas ou trafegadas por {label} podem ser expostas a terceiros.",
+        "Criptografar dados em repouso e em trânsito e aplicar controle de acesso de menor privilégio.",
+    ),
+    "Denial of Service": (
+        "{label} pode ficar indisponível por excesso de requisições ou exaustão de recursos.",
+        "Aplicar rate limiting, limites de recursos, autoscaling e monitoramento de disponibilidade.",
+    ),
+    "Elevation of Privilege": (
+        "Uma falha em {label} pode permitir que um usuário obtenha permissões além das concedidas.",
+        "Aplicar menor privilégio, segregar funções e validar autorização no servidor em cada operação.",
+    ),
+}
+
+
+def component_priority(component):
+    """
+    Criticidade do componente: peso do tipo, exposição a pontos de entrada
+    e proximidade da entrada (anotações de ThreatGraph.stride_units).
+    """
+    criticality = CRITICALITY.get(component.get("type"), 1) + (1 if component.get("exposed") else 0)
+    return criticality, -(component.get("hops_from_entry") or 0)
+
+
+def threat_priority(severity, component):
+    return (SEVERITY_RANK.get(severity, 1),) + component_priority(component)
+
+
+def template_enrichment(threat_type, component):
+    description, mitigation = THREAT_TEMPLATES.get(threat_type, (
+        "A ameaça {threat_type} pode afetar {label}.",
+        "Revisar os controles de segurança de {label} para {threat_type}.",
+    ))
+    fields = {"label": component.get("label") or "o componente", "threat_type": threat_type}
+    return {"description": description.format(**fields), "mitigation": mitigation.format(**fields)}
+
+
+class EnrichmentBudget:
+    """
+    Orçamento de tokens e de tempo de uma análise, compartilhado entre as
+    threads de enriquecimento. Antes de cada chamada reserva-se uma estimativa
+    (tokens_per_threat por ameaça); depois, o consumo real é cobrado e a
+    reserva liberada. Limites 0 = sem limite.
+
+    A reserva não espera: a ordem de prioridade é garantida por quem
+    reserva (admissão sequencial em processing._run_in_rounds), que tenta
+    de novo depois que as chamadas em voo cobram o gasto real. Ameaças que
+    ficaram de fora são registradas com deny().
+    """
+
+    def __init__(self, max_tokens=0, max_seconds=0, tokens_per_threat=600, spent_tokens=0):
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.tokens_per_threat = max(1, tokens_per_threat)
+        self.spent_tokens = spent_tokens
+        self.started = time.monotonic()
+        self.denied = 0
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+    @property
+    def limited(self):
+        return bool(self.max_tokens or self.max_seconds)
+
+    def remaining_seconds(self):
+        if not self.max_seconds:
+            return None
+        return max(0.0, self.max_seconds - (time.monotonic() - self.started))
+
+    def expired(self):
+        remaining = self.remaining_seconds()
+        return remaining is not None and remaining <= 0
+
+    def timeout(self, default):
+        # Nenhuma chamada passa do prazo da análise
+        remaining = self.remaining_seconds()
+        return default if remaining is None else max(0.1, min(default, remaining))
+
+    def reserve(self, n_threats):
+        """
+        Reserva até n_threats ameaças; retorna (quantas couberam, tokens reservados).
+        """
+        with self._lock:
+            if self.expired():
+                granted = 0
+            elif not self.max_tokens:
+                granted = n_threats
+            else:
+                available = self.max_tokens - self.spent_tokens - self._reserved
+                granted = max(0, min(n_threats, available // self.tokens_per_threat))
+            tokens = granted * self.tokens_per_threat
+            self._reserved += tokens
+            return granted, tokens
+
+    def deny(self, n_threats):
+        with self._lock:
+            self.denied += n_threats
+
+    def release(self, tokens):
+        with self._lock:
+            self._reserved = max(0, self._reserved - tokens)
+
+    def charge(self, tokens):
+        with self._lock:
+            self.spent_tokens += tokens
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "max_tokens": self.max_tokens,
+                "max_seconds": self.max_seconds,
+                "spent_tokens": self.spent_tokens,
+                "elapsed_seconds": round(time.monotonic() - self.started, 3),
+                "denied": self.denied,
+                "exhausted": self.denied > 0,
+            }
+
+
+def enrichment_summary(threats):
+    """
+    Conta a origem do texto de cada ameaça: llm, cache, template ou failed.
+    Totalmente enriquecidas = llm + cache.
+    """
+    counts = {"llm": 0, "cache": 0, "template": 0, "failed": 0}
+    for threat in threats:
+        source = threat.get("enrichment")
+        if source in counts:
+            counts[source] += 1
+    counts["fully_enriched"] = counts["llm"] + counts["cache"]
+    counts["total"] = len(threats)
+    return counts
@@ -1,17 +1,32 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image 
-from reportlab.lib import colors
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-import uuid, os, json
+import uuid, os, json, asyncio, hashlib, logging, queue, threading, zipfile
 from collections import defaultdict
-from processing import analyze_image, generate_stride_report, generate_stride_for_component
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+from contextlib import asynccontextmanager
+from functools import partial
+from jobs import create_backend, JobQueueFull
+from storage import AnalysisStore
+from janitor import Janitor
+from report_pdf import render_pdf, PDF_MODES
+from processing import analyze_image, generate_stride_report, generate_stride_for_component, iter_stride_components, generate_stride_batch
+import processing
+from graph import ThreatGraph, annotate, flow_unit, zone_of
+from scheduler import enrichment_summary
+import metrics
+from metrics import MetricsMiddleware, span
 import tempfile
 from fastapi.staticfiles import StaticFiles
 
+# Logs chave=valor (spans de tempo em INFO; chamadas individuais ao LLM em DEBUG)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+logger = logging.getLogger("stride.server")
+
 # Diretório temporário do sistema
 TEMP_DIR = tempfile.gettempdir()
 UPLOADS_DIR = os.path.join(TEMP_DIR, "uploads")
@@ -24,9 +39,162 @@ os.makedirs(REPORTS_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(STATIC_DIR, exist_ok=True)
 
-app = FastAPI()
+# Pools para trabalho bloqueante fora do event loop: um para chamadas curtas
+# (disco, SQLite, ReportLab) e outro para o trabalho longo de LLM (análise de
+# imagem e STRIDE), para que análises em andamento não atrasem as rotas baratas
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "16"))
+executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking")
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "8"))
+llm_executor = ThreadPoolExecutor(max_workers=LLM_POOL_SIZE, thread_name_prefix="llm")
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Executa uma função síncrona no pool bloqueante sem travar o event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(fn, *args, **kwargs))
+
+async def run_llm(fn, *args, **kwargs):
+    """
+    Como run_blocking, mas no pool de trabalho longo (chamadas ao LLM).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(llm_executor, partial(fn, *args, **kwargs))
+
+# Jobs de análise em segundo plano (fila limitada + pool de workers). O estado
+# de cada job vai para o store, então qualquer worker do uvicorn responde por ele
+job_backend = create_backend(
+    os.getenv("JOB_BACKEND", "local"),
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    queue_size=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+    on_change=lambda job: store.save_job(job.to_dict()),
+)
+metrics.gauge("job_queue_depth", "Jobs aguardando um worker", fn=lambda: job_backend.stats()["queued"])
+metrics.gauge("job_running", "Jobs em execução", fn=lambda: job_backend.stats()["running"])
+
+# Armazenamento das análises (SQLite compartilhado entre workers do uvicorn)
+ANALYSIS_DB_PATH = os.getenv("ANALYSIS_DB_PATH", os.path.join(DATA_DIR, "analyses.sqlite"))
+ANALYSIS_TTL = float(os.getenv("ANALYSIS_TTL", str(24 * 3600)))
+ANALYSIS_CLEANUP_INTERVAL = float(os.getenv("ANALYSIS_CLEANUP_INTERVAL", "600"))
+store = AnalysisStore(ANALYSIS_DB_PATH)
+
+def _cleanup_expired():
+    """
+    Remove as análises expiradas e seus uploads (e a cópia em STATIC_DIR).
+    """
+    removed = store.cleanup(ANALYSIS_TTL)
+    for _, file_path in removed:
+        if not file_path:
+            continue
+        for path in (file_path, os.path.join(STATIC_DIR, os.path.basename(file_path))):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return removed
+
+async def _cleanup_loop():
+    while True:
+        await asyncio.sleep(ANALYSIS_CLEANUP_INTERVAL)
+        try:
+            removed = await run_blocking(_cleanup_expired)
+            if removed:
+                logger.info("%d análise(s) expirada(s) removida(s)", len(removed))
+        except Exception:
+            logger.exception("Falha na limpeza de análises")
+
+# Uploads e limpeza de artefatos temporários
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+ARTIFACT_MAX_AGE = float(os.getenv("ARTIFACT_MAX_AGE", str(24 * 3600)))
+ARTIFACT_DISK_BUDGET = int(os.getenv("ARTIFACT_DISK_BUDGET", str(1024 * 1024 * 1024)))
+JANITOR_INTERVAL = float(os.getenv("JANITOR_INTERVAL", "300"))
+
+def _live_files():
+    # Uploads das análises ainda no store e suas cópias em STATIC_DIR
+    paths = set()
+    for file_path in store.list_file_paths():
+        paths.update((file_path, os.path.join(STATIC_DIR, os.path.basename(file_path))))
+    return paths
+
+janitor = Janitor(
+    [UPLOADS_DIR, STATIC_DIR, DATA_DIR, REPORTS_DIR],
+    max_age=ARTIFACT_MAX_AGE, disk_budget=ARTIFACT_DISK_BUDGET, in_use=_live_files,
+)
 
-analyses = {}
+# Lotes: limites do envio e pool compartilhado (análise de imagem e enriquecimento) entre lotes
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(200 * 1024 * 1024)))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp")
+
+async def _janitor_loop():
+    while True:
+        try:
+            removed, reclaimed = await run_blocking(janitor.run_once)
+            if removed:
+                logger.info("Janitor: %d arquivo(s) removido(s), %d bytes liberados", removed, reclaimed)
+        except Exception:
+            logger.exception("Falha no janitor")
+        await asyncio.sleep(JANITOR_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app):
+    tasks = [asyncio.create_task(_cleanup_loop()), asyncio.create_task(_janitor_loop())]
+    yield
+    for task in tasks:
+        task.cancel()
+    job_backend.shutdown()
+    batch_pool.shutdown(wait=False, cancel_futures=True)
+    llm_executor.shutdown(wait=False, cancel_futures=True)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+# Folga para cabeçalhos e boundaries do multipart além do arquivo em si
+MULTIPART_OVERHEAD = 64 * 1024
+
+class BodyLimitMiddleware:
+    """
+    Recusa com 413 corpos acima do limite da rota antes que o multipart seja
+    gravado em disco: pelo Content-Length, sem ler o corpo, ou (sem
+    Content-Length) assim que o total recebido passa do limite.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+        detail = f"Requisição excede o limite de {limit} bytes"
+        try:
+            length = int(dict(scope.get("headers") or []).get(b"content-length", b"-1"))
+        except ValueError:
+            length = -1
+        if length > limit:
+            return await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(BodyLimitMiddleware, limits={
+    "/api/upload": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+    "/api/batch": BATCH_MAX_BYTES + MULTIPART_OVERHEAD,
+})
+app.add_middleware(MetricsMiddleware)
 
 # CORS
 app.add_middleware(
@@ -41,6 +209,29 @@ app.add_middleware(
 
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
+class UploadTooLarge(Exception):
+    pass
+
+def _save_upload(src, path, max_bytes):
+    """
+    Copia o upload em blocos para o disco, abortando ao passar de max_bytes
+    (o BodyLimitMiddleware já recusou corpos muito maiores antes do spool).
+    """
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            for chunk in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Arquivo excede o limite de {max_bytes} bytes")
+                f.write(chunk)
+    except Exception:
+        # Sem arquivo parcial (limite excedido ou erro de leitura, ex.: zip corrompido)
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return size
+
 # --------------------
 # Step 1: Upload
 # --------------------
@@ -48,28 +239,33 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 async def upload_file(file: UploadFile = File(...)):
     analysis_id = str(uuid.uuid4())
     try:
-        file_path = os.path.join(UPLOADS_DIR, f"{analysis_id}_{file.filename}")
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
-
-        analyses[analysis_id] = {"filename": file.filename, "file_path": file_path, "components": {}, "stride_report": None}
+        file_path = os.path.join(UPLOADS_DIR, f"{analysis_id}_{os.path.basename(file.filename or 'upload')}")
+        try:
+            with span("upload", analysis_id=analysis_id) as fields:
+                fields["bytes"] = await run_blocking(_save_upload, file.file, file_path, MAX_UPLOAD_BYTES)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+        await run_blocking(store.create, analysis_id, file.filename, file_path)
         return {"analysis_id": analysis_id, "filename": file.filename, "message": "Upload realizado com sucesso"}
+    except HTTPException:
+        raise
     except Exception as e:
+        logger.exception("Falha no upload (analysis_id=%s)", analysis_id)
         return {"analysis_id": analysis_id, "error": str(e)}
     
 # --------------------
 # Step 2: Componentes
 # --------------------
-@app.get("/api/components/{analysis_id}")
-async def identify_components(analysis_id: str):
-    analysis = analyses.get(analysis_id)
-    if not analysis: 
-        raise HTTPException(status_code=404, detail="Analysis not found")
-
-    print(f"[LOG] Iniciando identificação de componentes para analysis_id={analysis_id}")
-
-    # Executa a análise da imagem
-    result = analyze_image(analysis["file_path"], analysis_id)
+def _identify_components_sync(analysis_id, use_cache=True):
+    analysis = store.get(analysis_id)
+    logger.info("Iniciando identificação de componentes para analysis_id=%s", analysis_id)
+
+    # Executa a análise da imagem (use_cache=False ignora análises anteriores da mesma imagem
+    # e descarta o STRIDE já gerado, que se refere aos componentes antigos)
+    with span("analyze_image", analysis_id=analysis_id) as fields:
+        result = analyze_image(analysis["file_path"], analysis_id, use_cache=use_cache)
+        fields.update(components=len(result.get("components", [])), cached=bool(result.get("cached_from")))
     raw_components = result.get("components", [])
 
     # Agrupa por tipo
@@ -83,17 +279,30 @@ async def identify_components(analysis_id: str):
             "label": label,
             "type": typ
         })
-        print(f"[LOG] Componente identificado: id={comp_id}, label='{label}', type='{typ}'")
+        logger.debug("Componente identificado: id=%s, label='%s', type='%s'", comp_id, label, typ)
+
+    # Salva na análise (a ordem agrupada por tipo é preservada), com a
+    # exposição de cada nó já calculada para as consultas por componente
+    components = [c for comps in grouped_components.values() for c in comps]
+    graph = dict(result.get("graph") or {})
+    graph["hops_from_entry"] = ThreatGraph(components, graph.get("edges")).hops_from_entry()
+    store.set_components(analysis_id, components, graph=graph, reset_stride=not use_cache)
 
     # Converte defaultdict para dict e garante fallback
     grouped_components = dict(grouped_components) if grouped_components else {"default": []}
 
-    # Salva no objeto de análise
-    analyses[analysis_id]["components"] = grouped_components
-
-    print(f"[LOG] Finalizada identificação de componentes. Total de tipos: {len(grouped_components)}")
+    logger.info("Finalizada identificação de componentes. Total de tipos: %d", len(grouped_components))
     for typ, comps in grouped_components.items():
-        print(f"[LOG] Tipo '{typ}' -> {len(comps)} componente(s)")
+        logger.debug("Tipo '%s' -> %d componente(s)", typ, len(comps))
+    return grouped_components
+
+@app.get("/api/components/{analysis_id}")
+async def identify_components(analysis_id: str, refresh: bool = Query(False)):
+    if not await run_blocking(store.exists, analysis_id):
+        raise HTTPException(status_code=404, detail="Analysis not found")
+
+    # refresh=true ignora análises anteriores da mesma imagem
+    grouped_components = await run_llm(_identify_components_sync, analysis_id, use_cache=not refresh)
 
     # Retorna o formato que o front espera
     return {"analysis_id": analysis_id, "components": grouped_components, "message": "Componentes identificados"}
@@ -103,11 +312,15 @@ async def identify_components(analysis_id: str):
 # --------------------
 @app.get("/api/stride/{analysis_id}")
 async def run_stride(analysis_id: str):
-    analysis = analyses.get(analysis_id)
+    analysis = await run_blocking(store.get, analysis_id)
     if not analysis: raise HTTPException(status_code=404)
-    all_comps = [c for comps in analysis.get("components", {}).values() for c in comps]
-    stride_report = generate_stride_report({"components": all_comps, "analysis_id": analysis_id})
-    analyses[analysis_id]["stride_report"] = stride_report
+    all_comps = [c for comps in analysis["components"].values() for c in comps]
+    with span("stride_report", analysis_id=analysis_id) as fields:
+        stride_report = await run_llm(
+            generate_stride_report, {"components": all_comps, "analysis_id": analysis_id, "graph": analysis["graph"]}
+        )
+        fields.update(threats=len(stride_report["threats"]), tokens=stride_report["usage"]["total_tokens"])
+    await run_blocking(store.set_stride_report, analysis_id, stride_report)
     return stride_report
 
 # --------------------
@@ -118,134 +331,667 @@ async def stride_incremental_post(data: dict):
     analysis_id = data.get("analysis_id")
     component_payload = data.get("component")
     if not component_payload: raise HTTPException(status_code=400, detail="Componente não enviado")
-    analysis = analyses.get(analysis_id)
-    if not analysis: raise HTTPException(status_code=404, detail="Analysis not found")
+    if not await run_blocking(store.exists, analysis_id): raise HTTPException(status_code=404, detail="Analysis not found")
 
-    # Procura componente pelo id
-    components = [c for comps in analysis.get("components", {}).values() for c in comps]
-    comp = next((c for c in components if c["id"] == component_payload.get("id")), None)
+    # Busca o componente (ou fluxo de fronteira) pela chave, anotado com a exposição no grafo
+    comp = await run_blocking(_stride_unit, analysis_id, str(component_payload.get("id")))
     if not comp: raise HTTPException(status_code=400, detail="Componente não encontrado")
 
     # Gera STRIDE incremental
-    result = generate_stride_for_component(comp, analysis_id)
-    if "stride_report_incremental" not in analysis:
-        analysis["stride_report_incremental"] = []
-    analysis["stride_report_incremental"].append(result)
+    budget = await run_blocking(_analysis_budget, analysis_id)
+    result = await run_llm(generate_stride_for_component, comp, analysis_id, None, budget)
+    await run_blocking(store.append_incremental, analysis_id, result)
+
+    # Retorna o array de threats para o frontend (e o uso de LLM da chamada)
+    return {"threats": result["threats"], "usage": result.get("usage")}
+
+def _analysis_graph(analysis_id):
+    analysis = store.get(analysis_id)
+    components = [c for comps in analysis["components"].values() for c in comps]
+    return ThreatGraph(components, analysis["graph"].get("edges"))
+
+def _stride_units(analysis_id):
+    """
+    Componentes e fluxos de fronteira da análise, em ordem de prioridade.
+    """
+    return _analysis_graph(analysis_id).stride_units()
 
-    # Retorna apenas o array de threats para o frontend
-    return {"threats": result["threats"]}
+def _graph_with_hops(analysis_id):
+    graph = store.get_graph(analysis_id)
+    if "hops_from_entry" not in graph:
+        # Análises identificadas antes da anotação: calcula uma vez e grava
+        graph["hops_from_entry"] = _analysis_graph(analysis_id).hops_from_entry()
+        store.set_graph(analysis_id, graph)
+    return graph
+
+def _stride_unit(analysis_id, unit_id):
+    """
+    Uma unidade STRIDE pelo id: componente (chave primária) ou fluxo de
+    fronteira "flow:origem->destino". None se não existir.
+    """
+    if not unit_id.startswith("flow:"):
+        comp = store.get_component(analysis_id, unit_id)
+        if comp is None:
+            return None
+        return annotate(comp, _graph_with_hops(analysis_id)["hops_from_entry"].get(unit_id))
+
+    src_id, _, dst_id = unit_id[len("flow:"):].partition("->")
+    src, dst = store.get_component(analysis_id, src_id), store.get_component(analysis_id, dst_id)
+    if src is None or dst is None or zone_of(src) == zone_of(dst):
+        return None
+    graph = _graph_with_hops(analysis_id)
+    if [src_id, dst_id] not in graph.get("edges", []):
+        return None
+    return flow_unit(src, dst, graph["hops_from_entry"])
+
+def _analysis_budget(analysis_id):
+    """
+    Orçamento de enriquecimento da análise, descontando os tokens já gastos
+    pelos componentes processados em requisições anteriores.
+    """
+    spent = processing.merge_usage(r.get("usage") for _, r in store.list_incremental(analysis_id))
+    return processing.new_budget(spent_tokens=spent["total_tokens"])
+
+def _incremental_report(analysis_id, incremental=None):
+    """
+    Junta todas as ameaças dos componentes incrementais em um relatório.
+    """
+    if incremental is None:
+        incremental = [r for _, r in store.list_incremental(analysis_id)]
+    all_threats = []
+    for inc in incremental:
+        all_threats.extend(inc.get("threats", []))
+    graph = _analysis_graph(analysis_id)
+    return {
+        "analysis_id": analysis_id,
+        "components_count": len(graph.nodes),
+        "threats": all_threats,
+        "graph": graph.summary(),
+        "usage": processing.merge_usage(inc.get("usage") for inc in incremental),
+        "enrichment": enrichment_summary(all_threats),
+    }
+
+def _pending_units(analysis_id):
+    done_ids = {r.get("component_id") for _, r in store.list_incremental(analysis_id)}
+    return [u for u in _stride_units(analysis_id) if u["id"] not in done_ids]
 
 # --------------------
-# Download de relatório
+# STRIDE via streaming (SSE)
 # --------------------
-@app.get("/api/report/{analysis_id}/download")
-async def download_report(analysis_id: str, format: str = Query("json")):
+def _sse(event, data, event_id=None):
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _component_events(result, seq):
+    for threat in result.get("threats", []):
+        yield _sse("threat", {"component_id": result.get("component_id"), **threat})
+    yield _sse("component_done", {
+        "component": result.get("component"),
+        "component_id": result.get("component_id"),
+        "threats": result.get("threats", []),
+    }, event_id=seq)
+
+class _StrideRun:
     """
-    Download de relatório em JSON ou PDF.
-    Ex.: /api/report/123/download?format=json ou format=pdf
+    Produtor do STRIDE em streaming de uma análise, compartilhado pelas
+    conexões SSE: quem reconecta (ou abre outra aba) se inscreve no produtor
+    em andamento, em vez de enriquecer de novo os componentes em voo.
     """
 
-    # Caminhos de saída
-    json_path = os.path.join(REPORTS_DIR, f"{analysis_id}_report.json")
-    pdf_path = os.path.join(REPORTS_DIR, f"{analysis_id}_report.pdf")
-
-    # Recupera análise em memória
-    analysis = analyses.get(analysis_id)
-    if not analysis:
-        raise HTTPException(status_code=404, detail="Análise não encontrada")
+    def __init__(self, analysis_id):
+        self.analysis_id = analysis_id
+        self.error = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, deliver):
+        # deliver((seq, result)) a cada componente gravado; deliver(None) no fim
+        with self._lock:
+            self._subscribers.append(deliver)
+
+    def unsubscribe(self, deliver):
+        with self._lock:
+            self._subscribers = [d for d in self._subscribers if d is not deliver]
+
+    def _publish(self, item):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for deliver in subscribers:
+            deliver(item)
+
+    def run(self, pending):
+        # Roda no pool de LLM: os resultados são gravados mesmo sem nenhum cliente conectado
+        try:
+            budget = _analysis_budget(self.analysis_id)
+            for result in iter_stride_components(pending, self.analysis_id, budget=budget):
+                self._publish((store.append_incremental(self.analysis_id, result), result))
+        except Exception as e:
+            logger.exception("Falha no STRIDE (analysis_id=%s)", self.analysis_id)
+            self.error = e
+        finally:
+            with _stride_runs_lock:
+                _stride_runs.pop(self.analysis_id, None)
+            self._publish(None)
+
+# Produtores em andamento, por análise. O registro é deste processo: com vários
+# workers do uvicorn, streams e jobs da mesma análise só compartilham o produtor
+# quando caem no mesmo worker
+_stride_runs = {}
+_stride_runs_lock = threading.Lock()
+
+def _attach_stride_run(analysis_id, deliver):
+    """
+    Inscreve `deliver` (conexão SSE ou job) no produtor em andamento da
+    análise ou inicia um novo com as unidades que ainda faltam. Retorna o
+    produtor, ou None se não há nada a processar.
+    """
+    with _stride_runs_lock:
+        run = _stride_runs.get(analysis_id)
+        if run is None:
+            pending = _pending_units(analysis_id)
+            if not pending:
+                return None
+            run = _stride_runs[analysis_id] = _StrideRun(analysis_id)
+            llm_executor.submit(run.run, pending)
+        run.subscribe(deliver)
+    return run
+
+@app.get("/api/stride/{analysis_id}/stream")
+async def stream_stride(analysis_id: str, request: Request, last_event_id: int = Query(None)):
+    """
+    Emite as ameaças de cada componente assim que ficam prontas.
+    Eventos: start (total de unidades: componentes e fluxos de fronteira),
+    threat, component_done (com id sequencial) e done.
+    Retomável: com Last-Event-ID (ou ?last_event_id=N), reenvia só os
+    componentes após o N-ésimo e processa os que ainda faltam; se o
+    processamento ainda estiver em andamento, acompanha o mesmo produtor.
+    """
+    if not await run_blocking(store.exists, analysis_id): raise HTTPException(status_code=404, detail="Analysis not found")
 
-    # --- Monta o relatório a partir do incremental ---
-    # Se a análise incremental existir, usamos ela; caso contrário, gera STRIDE completo
-    if "stride_report_incremental" in analysis and analysis["stride_report_incremental"]:
-        # Junta todas as ameaças dos componentes incrementais
-        all_threats = []
-        for inc in analysis["stride_report_incremental"]:
-            all_threats.extend(inc.get("threats", []))
-        report = {
+    header_id = request.headers.get("last-event-id")
+    try:
+        start = int(last_event_id if last_event_id is not None else header_id or 0)
+    except ValueError:
+        start = 0
+
+    # Inscreve antes de ler o replay: o que ficar pronto entre os dois chega pela fila (sem duplicar)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def deliver(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            pass  # event loop encerrado; o resultado já foi gravado
+
+    run = await run_blocking(_attach_stride_run, analysis_id, deliver)
+    replay = await run_blocking(store.list_incremental, analysis_id, start)
+    units = len(await run_blocking(_stride_units, analysis_id))
+
+    async def events():
+        sent = set()
+        yield _sse("start", {"analysis_id": analysis_id, "units": units})
+        try:
+            for seq, result in replay:
+                sent.add(seq)
+                for chunk in _component_events(result, seq):
+                    yield chunk
+            while run is not None:
+                item = await queue.get()
+                if item is None:
+                    break
+                seq, result = item
+                if seq <= start or seq in sent:
+                    continue
+                sent.add(seq)
+                for chunk in _component_events(result, seq):
+                    yield chunk
+        finally:
+            if run is not None:
+                run.unsubscribe(deliver)
+        total = [r for _, r in await run_blocking(store.list_incremental, analysis_id)]
+        yield _sse("done", {
             "analysis_id": analysis_id,
-            "components_count": len([c for comps in analysis.get("components", {}).values() for c in comps]),
-            "threats": all_threats,
-            "graph": {},  # se tiver grafo, pode incluir
-        }
-    else:
-        # fallback: STRIDE completo
-        all_comps = [c for comps in analysis.get("components", {}).values() for c in comps]
-        report = generate_stride_report({"components": all_comps, "analysis_id": analysis_id})
-
-    # Salva JSON atualizado em disco
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(report, f, ensure_ascii=False, indent=2)
-
-    # --- Retorna JSON ---
-    if format.lower() == "json":
-        response = FileResponse(
-            json_path,
-            media_type="application/json",
-            filename=f"report_{analysis_id}.json"
-        )
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        return response
-
-    # --- Retorna PDF ---
-    elif format.lower() == "pdf":
-        doc = SimpleDocTemplate(pdf_path, pagesize=letter)
-        styles = getSampleStyleSheet()
-        elements = []
-
-        # Título
-        elements.append(Paragraph(f"Relatório STRIDE - Análise {analysis_id}", styles["Title"]))
-        elements.append(Spacer(1, 12))
-
-        # Resumo
-        threats = report.get("threats", [])
-        grouped = defaultdict(list)
-        for t in threats:
-            grouped[t.get("component", "Sem nome")].append(t)
-
-        total_comps = len(grouped)
-        total_threats = len(threats)
-        elements.append(Paragraph(f"Total de componentes: {total_comps}", styles["Normal"]))
-        elements.append(Paragraph(f"Total de ameaças: {total_threats}", styles["Normal"]))
-        elements.append(Spacer(1, 12))
-
-        # Tabelas por componente
-        if grouped:
-            for comp_name, comp_threats in grouped.items():
-                elements.append(Paragraph(f"Componente: {comp_name}", styles["Heading2"]))
-                data = [["Tipo", "Descrição", "Mitigação"]]
-                for idx, t in enumerate(comp_threats, start=1):
-                    data.append([
-                        Paragraph(f"{idx}. {t.get('threat_type', '-')}", styles["Normal"]),
-                        Paragraph(t.get("description", "-"), styles["Normal"]),
-                        Paragraph(t.get("mitigation", "-"), styles["Normal"]),
-                    ])
-                table = Table(data, colWidths=[100, "*", 150])
-                table.setStyle(TableStyle([
-                    ("BACKGROUND", (0,0), (-1,0), colors.grey),
-                    ("TEXTCOLOR", (0,0), (-1,0), colors.whitesmoke),
-                    ("ALIGN", (0,0), (-1,-1), "LEFT"),
-                    ("VALIGN", (0,0), (-1,-1), "TOP"),
-                    ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
-                    ("FONTSIZE", (0,0), (-1,0), 10),
-                    ("BOTTOMPADDING", (0,0), (-1,0), 8),
-                    ("BACKGROUND", (0,1), (-1,-1), colors.beige),
-                    ("GRID", (0,0), (-1,-1), 0.5, colors.black),
-                ]))
-                elements.append(table)
-                elements.append(Spacer(1, 12))
-        else:
-            elements.append(Paragraph("Nenhuma ameaça detectada.", styles["Normal"]))
-
-        # Gera PDF
-        doc.build(elements)
-
-        response = FileResponse(
-            pdf_path,
-            media_type="application/pdf",
-            filename=f"report_{analysis_id}.pdf"
-        )
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        return response
+            "components": len(total),
+            "threats": sum(len(r.get("threats", [])) for r in total),
+        })
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
 
+# --------------------
+# Jobs em segundo plano
+# --------------------
+def _run_analysis_job(job, analysis_id, run_stride, refresh):
+    job.update(analysis_id=analysis_id, stage="components")
+    if refresh or not store.list_components(analysis_id):
+        _identify_components_sync(analysis_id, use_cache=not refresh)
+
+    # Unidades = componentes + fluxos que cruzam fronteiras de confiança
+    units = _stride_units(analysis_id)
+    if not run_stride:
+        job.update(stage="done", components_total=len(units))
+        return {"analysis_id": analysis_id, "components": store.get(analysis_id)["components"]}
+
+    # Mesmo produtor do SSE: um stream aberto na análise não enriquece as unidades de novo.
+    # Inscreve antes de contar o que já foi gravado (como o stream faz com o replay)
+    results = queue.Queue()
+    deliver = results.put
+    run = _attach_stride_run(analysis_id, deliver)
+    recorded = store.list_incremental(analysis_id)
+    seen = {seq for seq, _ in recorded}
+    done = len(recorded)
+    threats_done = sum(len(r.get("threats", [])) for _, r in recorded)
+    job.update(stage="stride", components_total=len(units), components_done=done, threats_done=threats_done)
+
+    with span("stride_job", analysis_id=analysis_id, units=len(units) - done):
+        try:
+            while run is not None:
+                item = results.get()
+                if item is None:
+                    break
+                seq, result = item
+                if seq in seen:
+                    continue
+                seen.add(seq)
+                done += 1
+                threats_done += len(result["threats"])
+                job.update(components_done=done, threats_done=threats_done)
+        finally:
+            if run is not None:
+                run.unsubscribe(deliver)
+        if run is not None and run.error is not None:
+            raise run.error
+
+    job.update(stage="done")
+    report = _incremental_report(analysis_id)
+    store.set_stride_report(analysis_id, report)
+    return {"analysis_id": analysis_id, "components": store.get(analysis_id)["components"], "stride_report": report}
+
+@app.post("/api/jobs/analysis/{analysis_id}")
+async def submit_analysis_job(analysis_id: str, stride: bool = Query(True), refresh: bool = Query(False)):
+    """
+    Enfileira a identificação de componentes e (opcionalmente) o STRIDE
+    completo; retorna imediatamente o job_id para acompanhamento.
+    """
+    if not await run_blocking(store.exists, analysis_id):
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    try:
+        job = job_backend.submit("analysis", _run_analysis_job, analysis_id, stride, refresh)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return JSONResponse(job.to_dict(include_result=False), status_code=202)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, include_result: bool = Query(True)):
+    job = job_backend.get(job_id)
+    if job:
+        return job.to_dict(include_result=include_result)
+    # Job aceito por outro worker (ou já fora da memória): estado gravado no store
+    data = await run_blocking(store.get_job, job_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if not include_result:
+        data.pop("result", None)
+    return data
+
+# --------------------
+# Lote de diagramas
+# --------------------
+def _extract_zip(zip_path, prefix, max_files):
+    """
+    Extrai só as imagens do zip (até max_files), cada uma limitada a
+    MAX_UPLOAD_BYTES pelo tamanho real lido. Retorna (salvos, ignorados).
+    Em caso de erro, remove as imagens já extraídas.
+    """
+    saved, skipped = [], []
+    try:
+        with zipfile.ZipFile(zip_path) as zf:
+            for info in zf.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+                    continue
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    skipped.append(info.filename)
+                    continue
+                if len(saved) >= max_files:
+                    raise UploadTooLarge(f"O lote excede o limite de {BATCH_MAX_FILES} diagramas")
+                path = os.path.join(UPLOADS_DIR, f"{prefix}_{len(saved)}_{name}")
+                with zf.open(info) as src:
+                    _save_upload(src, path, MAX_UPLOAD_BYTES)
+                saved.append((name, path))
+    except Exception:
+        for _, path in saved:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return saved, skipped
+
+def _save_batch_files(batch_id, files):
+    """
+    Salva os arquivos do lote (imagens ou zips de imagens) e retorna
+    ([(filename, path)], ignorados). BATCH_MAX_BYTES vale para a soma dos
+    arquivos enviados; cada imagem avulsa também segue MAX_UPLOAD_BYTES.
+    Em caso de erro, remove o que já foi salvo.
+    """
+    diagrams, skipped = [], []
+    total = 0
+
+    def save(src, path, max_bytes):
+        nonlocal total
+        remaining = BATCH_MAX_BYTES - total
+        try:
+            total += _save_upload(src, path, min(max_bytes, remaining))
+        except UploadTooLarge:
+            if remaining < max_bytes:
+                raise UploadTooLarge(f"O lote excede o limite de {BATCH_MAX_BYTES} bytes")
+            raise
+
+    try:
+        for i, file in enumerate(files):
+            name = os.path.basename(file.filename or "upload")
+            path = os.path.join(UPLOADS_DIR, f"{batch_id}_{i}_{name}")
+            if name.lower().endswith(".zip"):
+                save(file.file, path, BATCH_MAX_BYTES)
+                try:
+                    extracted, ignored = _extract_zip(path, f"{batch_id}_{i}", BATCH_MAX_FILES - len(diagrams))
+                finally:
+                    os.remove(path)
+                diagrams.extend(extracted)
+                skipped.extend(ignored)
+            else:
+                if len(diagrams) >= BATCH_MAX_FILES:
+                    raise UploadTooLarge(f"O lote excede o limite de {BATCH_MAX_FILES} diagramas")
+                save(file.file, path, MAX_UPLOAD_BYTES)
+                diagrams.append((name, path))
+    except Exception:
+        for _, path in diagrams:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return diagrams, skipped
+
+def _create_batch(batch_id, diagrams):
+    analysis_ids = []
+    for filename, path in diagrams:
+        analysis_id = str(uuid.uuid4())
+        store.create(analysis_id, filename, path)
+        analysis_ids.append(analysis_id)
+    # O lote fica em tabela própria (relatório consolidado e diagramas), fora dos endpoints de análise
+    store.create_batch(batch_id, analysis_ids)
+    return analysis_ids
+
+def _batch_report(batch_id, analyses, result):
+    """
+    Relatório consolidado: ameaças de todos os diagramas, cada uma com o
+    diagrama de origem, mais contadores de deduplicação e uso de LLM.
+    """
+    diagrams, threats = [], []
+    for analysis, report in zip(analyses, result["reports"]):
+        filename = analysis["filename"]
+        diagrams.append({
+            "analysis_id": analysis["analysis_id"],
+            "filename": filename,
+            "components_count": report["components_count"],
+            "threats_count": len(report["threats"]),
+        })
+        threats.extend(dict(t, diagram=filename, analysis_id=analysis["analysis_id"]) for t in report["threats"])
+    return {
+        "analysis_id": batch_id,
+        "batch_id": batch_id,
+        "diagrams": diagrams,
+        "components_count": sum(d["components_count"] for d in diagrams),
+        "threats": threats,
+        "usage": result["usage"],
+        "enrichment": {**enrichment_summary(threats), "budget": result["budget"]},
+        "dedup": result["dedup"],
+    }
+
+def _run_batch_job(job, batch_id, run_stride):
+    # A falha fica gravada no lote: GET /api/batch responde failed mesmo sem o job
+    try:
+        return _process_batch(job, batch_id, run_stride)
+    except Exception as e:
+        store.set_batch_status(batch_id, "failed", str(e))
+        raise
+
+def _process_batch(job, batch_id, run_stride):
+    analysis_ids = store.get_batch(batch_id)["analysis_ids"]
+    job.update(batch_id=batch_id, stage="components", diagrams_total=len(analysis_ids), diagrams_done=0)
+
+    # Análise das imagens no pool compartilhado entre lotes
+    done = 0
+    futures = {batch_pool.submit(_identify_components_sync, aid): aid for aid in analysis_ids}
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception:
+            logger.exception("Falha ao identificar componentes (analysis_id=%s, lote=%s)", futures[future], batch_id)
+        done += 1
+        job.update(diagrams_done=done)
+
+    analyses = []
+    for aid in analysis_ids:
+        analysis = store.get(aid)
+        analyses.append({
+            "analysis_id": aid,
+            "filename": analysis["filename"],
+            "components": [c for comps in analysis["components"].values() for c in comps],
+            "graph": analysis["graph"],
+        })
+    if not run_stride:
+        store.set_batch_status(batch_id, "done")
+        job.update(stage="done")
+        return {"batch_id": batch_id, "diagrams": [
+            {"analysis_id": a["analysis_id"], "filename": a["filename"], "components_count": len(a["components"])}
+            for a in analyses
+        ]}
+
+    job.update(stage="stride")
+    with span("stride_batch", batch_id=batch_id, diagrams=len(analyses)) as fields:
+        result = generate_stride_batch(analyses, executor=batch_pool)
+        fields.update(result["dedup"])
+    for report in result["reports"]:
+        store.set_stride_report(report["analysis_id"], report)
+    report = _batch_report(batch_id, analyses, result)
+    store.set_batch_report(batch_id, report)
+
+    job.update(stage="done", **result["dedup"])
+    return {k: report[k] for k in ("batch_id", "diagrams", "usage", "enrichment", "dedup")}
+
+@app.post("/api/batch")
+async def submit_batch(files: List[UploadFile] = File(...), stride: bool = Query(True)):
+    """
+    Recebe vários diagramas (imagens e/ou zips de imagens) e enfileira um
+    único job: componentes de todos os diagramas, STRIDE com enriquecimento
+    deduplicado entre eles e relatório consolidado, disponível em
+    /api/report/{batch_id}/download. Cada diagrama também vira uma análise
+    comum, com seus próprios endpoints.
+    """
+    batch_id = str(uuid.uuid4())
+    try:
+        diagrams, skipped = await run_blocking(_save_batch_files, batch_id, files)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Arquivo zip inválido")
+    if not diagrams:
+        raise HTTPException(status_code=400, detail="Nenhum diagrama encontrado no lote")
+
+    analysis_ids = await run_blocking(_create_batch, batch_id, diagrams)
+    try:
+        job = job_backend.submit("batch", _run_batch_job, batch_id, stride)
+    except JobQueueFull as e:
+        await run_blocking(store.set_batch_status, batch_id, "failed", str(e))
+        raise HTTPException(status_code=503, detail=str(e))
+    return JSONResponse({
+        **job.to_dict(include_result=False),
+        "batch_id": batch_id,
+        "diagrams": [{"analysis_id": aid, "filename": name} for aid, (name, _) in zip(analysis_ids, diagrams)],
+        "skipped": skipped,
+    }, status_code=202)
+
+def _batch_status(batch_id):
+    batch = store.get_batch(batch_id)
+    if batch is None:
+        return None
+    diagrams = []
+    for aid in batch["analysis_ids"]:
+        analysis = store.get(aid)
+        if analysis is None:
+            continue  # diagrama já expirado
+        diagrams.append({
+            "analysis_id": aid,
+            "filename": analysis["filename"],
+            "components_count": sum(len(comps) for comps in analysis["components"].values()),
+            "stride_done": analysis["stride_report"] is not None,
+        })
+    report = batch["stride_report"] or {}
+    return {
+        "batch_id": batch_id,
+        "status": batch["status"],
+        "error": batch["error"],
+        "diagrams": diagrams,
+        "dedup": report.get("dedup"),
+        "usage": report.get("usage"),
+        "enrichment": report.get("enrichment"),
+        "report_url": f"/api/report/{batch_id}/download" if report else None,
+    }
+
+@app.get("/api/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    status = await run_blocking(_batch_status, batch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Lote não encontrado")
+    return status
+
+# --------------------
+# Métricas
+# --------------------
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Métricas no formato texto do Prometheus (latências, chamadas e tokens do LLM, cache).
+    """
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --------------------
+# Cache de enriquecimento
+# --------------------
+@app.get("/api/cache/stats")
+async def cache_stats():
+    if processing.enrichment_cache is None:
+        return {"enabled": False}
+    stats = await run_blocking(processing.enrichment_cache.stats)
+    return {"enabled": True, **stats}
+
+@app.get("/api/janitor/stats")
+async def janitor_stats():
+    return janitor.stats()
+
+# --------------------
+# Geração de arquivos (bloqueante; executar via run_blocking)
+# --------------------
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+# --------------------
+# Download de relatório
+# --------------------
+REPORT_MEDIA_TYPES = {"json": "application/json", "pdf": "application/pdf"}
+
+# Acima deste número de ameaças, pdf_mode=auto usa o renderizador rápido
+PDF_FAST_THRESHOLD = int(os.getenv("PDF_FAST_THRESHOLD", "300"))
+
+def _report_version(report):
+    """
+    Hash do conteúdo do relatório (ameaças, componentes e grafo): muda só
+    quando as ameaças mudam.
+    """
+    content = {k: report.get(k) for k in ("threats", "components_count", "graph")}
+    payload = json.dumps(content, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _current_report(analysis_id):
+    """
+    Relatório a partir do STRIDE incremental ou, na falta dele, do STRIDE
+    completo já gerado. Nunca dispara novo enriquecimento; None se não houver.
+    """
+    incremental = [r for _, r in store.list_incremental(analysis_id)]
+    if incremental:
+        return _incremental_report(analysis_id, incremental)
+    return store.get(analysis_id)["stride_report"]
+
+def _render_report(analysis_id, fmt, report, version, pdf_mode="full"):
+    """
+    Retorna o caminho do arquivo do relatório na versão pedida, gerando-o
+    apenas se ainda não existir em cache.
+    """
+    variant = fmt if fmt == "json" else f"pdf-{pdf_mode}"
+    cached = store.get_report(analysis_id, variant)
+    if cached and cached["version"] == version and os.path.exists(cached["path"]):
+        return cached["path"]
+
+    path = os.path.join(REPORTS_DIR, f"{analysis_id}_{version[:16]}_report_{variant}.{fmt}")
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    if fmt == "json":
+        _write_json(tmp_path, report)
     else:
+        with span("pdf_render", analysis_id=analysis_id, mode=pdf_mode, threats=len(report.get("threats", []))):
+            render_pdf(report, analysis_id, tmp_path, pdf_mode)
+    os.replace(tmp_path, path)
+
+    store.set_report(analysis_id, variant, version, path)
+    if cached and cached["path"] != path and os.path.exists(cached["path"]):
+        os.remove(cached["path"])
+    return path
+
+@app.get("/api/report/{analysis_id}/download")
+async def download_report(analysis_id: str, request: Request, format: str = Query("json"),
+                          pdf_mode: str = Query("auto")):
+    """
+    Download de relatório em JSON ou PDF.
+    Ex.: /api/report/123/download?format=json ou format=pdf
+    pdf_mode: full (tabelas), fast (renderização direta), summary (só contagens)
+    ou auto (fast acima de PDF_FAST_THRESHOLD ameaças).
+    O arquivo é versionado pelo hash das ameaças (ETag) e só é regerado
+    quando elas mudam; If-None-Match com a versão atual retorna 304.
+    """
+    fmt = format.lower()
+    if fmt not in REPORT_MEDIA_TYPES:
         raise HTTPException(status_code=400, detail="Formato inválido (use json ou pdf)")
+    pdf_mode = pdf_mode.lower()
+    if pdf_mode not in PDF_MODES + ("auto",):
+        raise HTTPException(status_code=400, detail="pdf_mode inválido (use auto, full, fast ou summary)")
+
+    # Recupera a análise (ou o lote, com o relatório consolidado) no store
+    if await run_blocking(store.exists, analysis_id):
+        report = await run_blocking(_current_report, analysis_id)
+    else:
+        batch = await run_blocking(store.get_batch, analysis_id)
+        if batch is None:
+            raise HTTPException(status_code=404, detail="Análise não encontrada")
+        report = batch["stride_report"]
+    if report is None:
+        raise HTTPException(status_code=409, detail="STRIDE ainda não gerado para esta análise")
+
+    if pdf_mode == "auto":
+        pdf_mode = "fast" if len(report.get("threats", [])) > PDF_FAST_THRESHOLD else "full"
+    variant = fmt if fmt == "json" else f"pdf-{pdf_mode}"
+
+    version = await run_blocking(_report_version, report)
+    etag = f'"{version[:32]}-{variant}"'
+    headers = {"ETag": etag, "Access-Control-Allow-Origin": "*", "Access-Control-Expose-Headers": "ETag"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    path = await run_blocking(_render_report, analysis_id, fmt, report, version, pdf_mode)
+    return FileResponse(
+        path,
+        media_type=REPORT_MEDIA_TYPES[fmt],
+        filename=f"report_{analysis_id}.{fmt}",
+        headers=headers
+    )
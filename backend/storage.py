@@ -0,0 +1,349 @@
+# storage.py
+import json, os, sqlite3, threading, time
+from collections import defaultdict
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id TEXT PRIMARY KEY,
+    filename TEXT,
+    file_path TEXT,
+    graph TEXT,
+    stride_report TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_updated ON analyses(updated_at);
+
+CREATE TABLE IF NOT EXISTS components (
+    analysis_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    label TEXT,
+    type TEXT,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (analysis_id, id)
+);
+
+CREATE TABLE IF NOT EXISTS threats_incremental (
+    analysis_id TEXT NOT NULL,
+    component_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (analysis_id, component_id)
+);
+CREATE INDEX IF NOT EXISTS idx_incremental_seq ON threats_incremental(analysis_id, seq);
+
+CREATE TABLE IF NOT EXISTS reports (
+    analysis_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    version TEXT NOT NULL,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (analysis_id, format)
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at);
+
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    stride_report TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_batches_updated ON batches(updated_at);
+
+CREATE TABLE IF NOT EXISTS batch_analyses (
+    batch_id TEXT NOT NULL,
+    analysis_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (batch_id, analysis_id)
+);
+"""
+
+CHILD_TABLES = ("components", "threats_incremental", "reports")
+
+
+class AnalysisStore:
+    """
+    Armazenamento das análises em SQLite (WAL), compartilhável entre
+    processos do uvicorn. Cada thread usa sua própria conexão.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        # Bancos criados antes do estado do lote
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(batches)")}
+        if "status" not in columns:
+            conn.execute("ALTER TABLE batches ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'")
+            conn.execute("ALTER TABLE batches ADD COLUMN error TEXT")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        # Transação de escrita explícita: serializa escritores entre processos
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _touch(self, conn, analysis_id):
+        conn.execute("UPDATE analyses SET updated_at = ? WHERE id = ?", (time.time(), analysis_id))
+
+    # --------------------
+    # Análises
+    # --------------------
+    def create(self, analysis_id, filename, file_path):
+        now = time.time()
+        self._write(lambda conn: conn.execute(
+            "INSERT INTO analyses (id, filename, file_path, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (analysis_id, filename, file_path, now, now),
+        ))
+
+    def exists(self, analysis_id):
+        row = self._conn().execute("SELECT 1 FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+        return row is not None
+
+    def get(self, analysis_id):
+        """
+        Retorna a análise no formato usado pelo servidor (components agrupados
+        por tipo), ou None se não existir.
+        """
+        row = self._conn().execute(
+            "SELECT filename, file_path, graph, stride_report FROM analyses WHERE id = ?", (analysis_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        grouped = defaultdict(list)
+        for comp in self.list_components(analysis_id):
+            grouped[comp["type"]].append(comp)
+        return {
+            "analysis_id": analysis_id,
+            "filename": row[0],
+            "file_path": row[1],
+            "graph": json.loads(row[2]) if row[2] else {},
+            "stride_report": json.loads(row[3]) if row[3] else None,
+            "components": dict(grouped),
+        }
+
+    def set_stride_report(self, analysis_id, report):
+        def fn(conn):
+            conn.execute(
+                "UPDATE analyses SET stride_report = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(report, ensure_ascii=False), time.time(), analysis_id),
+            )
+        self._write(fn)
+
+    def list_file_paths(self):
+        """
+        Arquivos de upload de todas as análises existentes.
+        """
+        rows = self._conn().execute("SELECT file_path FROM analyses WHERE file_path IS NOT NULL").fetchall()
+        return [r[0] for r in rows]
+
+    def cleanup(self, ttl):
+        """
+        Remove análises, lotes e jobs sem atualização há mais de `ttl` segundos.
+        Retorna as análises removidas (id, file_path) para limpeza de arquivos.
+        """
+        limit = time.time() - ttl
+
+        def fn(conn):
+            rows = conn.execute("SELECT id, file_path FROM analyses WHERE updated_at < ?", (limit,)).fetchall()
+            for analysis_id, _ in rows:
+                for table in CHILD_TABLES:
+                    conn.execute(f"DELETE FROM {table} WHERE analysis_id = ?", (analysis_id,))
+                conn.execute("DELETE FROM analyses WHERE id = ?", (analysis_id,))
+            for (batch_id,) in conn.execute("SELECT id FROM batches WHERE updated_at < ?", (limit,)).fetchall():
+                conn.execute("DELETE FROM batch_analyses WHERE batch_id = ?", (batch_id,))
+                conn.execute("DELETE FROM reports WHERE analysis_id = ?", (batch_id,))
+                conn.execute("DELETE FROM batches WHERE id = ?", (batch_id,))
+            conn.execute("DELETE FROM jobs WHERE updated_at < ?", (limit,))
+            return rows
+        return self._write(fn)
+
+    # --------------------
+    # Componentes
+    # --------------------
+    def set_components(self, analysis_id, components, graph=None, reset_stride=False):
+        """
+        Substitui os componentes (lista plana, na ordem de exibição). Com
+        reset_stride, descarta também o STRIDE (incremental e completo) dos
+        componentes anteriores.
+        """
+        def fn(conn):
+            if reset_stride:
+                conn.execute("DELETE FROM threats_incremental WHERE analysis_id = ?", (analysis_id,))
+                conn.execute("UPDATE analyses SET stride_report = NULL WHERE id = ?", (analysis_id,))
+            conn.execute("DELETE FROM components WHERE analysis_id = ?", (analysis_id,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO components (analysis_id, id, label, type, position) VALUES (?, ?, ?, ?, ?)",
+                [(analysis_id, c["id"], c.get("label"), c.get("type"), i) for i, c in enumerate(components)],
+            )
+            if graph is not None:
+                conn.execute("UPDATE analyses SET graph = ? WHERE id = ?", (json.dumps(graph, ensure_ascii=False), analysis_id))
+            self._touch(conn, analysis_id)
+        self._write(fn)
+
+    def get_graph(self, analysis_id):
+        row = self._conn().execute("SELECT graph FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def set_graph(self, analysis_id, graph):
+        self._write(lambda conn: conn.execute(
+            "UPDATE analyses SET graph = ? WHERE id = ?", (json.dumps(graph, ensure_ascii=False), analysis_id)
+        ))
+
+    def list_components(self, analysis_id):
+        rows = self._conn().execute(
+            "SELECT id, label, type FROM components WHERE analysis_id = ? ORDER BY position", (analysis_id,)
+        ).fetchall()
+        return [{"id": r[0], "label": r[1], "type": r[2]} for r in rows]
+
+    def get_component(self, analysis_id, component_id):
+        row = self._conn().execute(
+            "SELECT id, label, type FROM components WHERE analysis_id = ? AND id = ?", (analysis_id, component_id)
+        ).fetchone()
+        return {"id": row[0], "label": row[1], "type": row[2]} if row else None
+
+    # --------------------
+    # STRIDE incremental
+    # --------------------
+    def append_incremental(self, analysis_id, result):
+        """
+        Grava o resultado de um componente (substitui se já existir) e
+        retorna seu número de sequência dentro da análise.
+        """
+        component_id = str(result.get("component_id"))
+
+        def fn(conn):
+            row = conn.execute(
+                "SELECT seq FROM threats_incremental WHERE analysis_id = ? AND component_id = ?",
+                (analysis_id, component_id),
+            ).fetchone()
+            if row is not None:
+                seq = row[0]
+            else:
+                seq = conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) + 1 FROM threats_incremental WHERE analysis_id = ?", (analysis_id,)
+                ).fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO threats_incremental (analysis_id, component_id, seq, result) VALUES (?, ?, ?, ?)",
+                (analysis_id, component_id, seq, json.dumps(result, ensure_ascii=False)),
+            )
+            self._touch(conn, analysis_id)
+            return seq
+        return self._write(fn)
+
+    def list_incremental(self, analysis_id, after_seq=0):
+        """
+        Resultados incrementais em ordem de conclusão, como pares (seq, result).
+        """
+        rows = self._conn().execute(
+            "SELECT seq, result FROM threats_incremental WHERE analysis_id = ? AND seq > ? ORDER BY seq",
+            (analysis_id, after_seq),
+        ).fetchall()
+        return [(seq, json.loads(result)) for seq, result in rows]
+
+    # --------------------
+    # Lotes (tabela própria com o relatório consolidado; os diagramas são análises comuns)
+    # --------------------
+    def create_batch(self, batch_id, analysis_ids):
+        now = time.time()
+
+        def fn(conn):
+            conn.execute(
+                "INSERT INTO batches (id, created_at, updated_at) VALUES (?, ?, ?)", (batch_id, now, now)
+            )
+            conn.executemany(
+                "INSERT INTO batch_analyses (batch_id, analysis_id, position) VALUES (?, ?, ?)",
+                [(batch_id, analysis_id, i) for i, analysis_id in enumerate(analysis_ids)],
+            )
+        self._write(fn)
+
+    def get_batch(self, batch_id):
+        """
+        Retorna {"batch_id", "status", "error", "analysis_ids", "stride_report"},
+        ou None se o lote não existir. status: pending, done ou failed.
+        """
+        conn = self._conn()
+        row = conn.execute("SELECT status, error, stride_report FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if row is None:
+            return None
+        rows = conn.execute(
+            "SELECT analysis_id FROM batch_analyses WHERE batch_id = ? ORDER BY position", (batch_id,)
+        ).fetchall()
+        return {
+            "batch_id": batch_id,
+            "status": row[0],
+            "error": row[1],
+            "analysis_ids": [r[0] for r in rows],
+            "stride_report": json.loads(row[2]) if row[2] else None,
+        }
+
+    def set_batch_report(self, batch_id, report):
+        self._write(lambda conn: conn.execute(
+            "UPDATE batches SET stride_report = ?, status = 'done', updated_at = ? WHERE id = ?",
+            (json.dumps(report, ensure_ascii=False), time.time(), batch_id),
+        ))
+
+    def set_batch_status(self, batch_id, status, error=None):
+        self._write(lambda conn: conn.execute(
+            "UPDATE batches SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), batch_id),
+        ))
+
+    # --------------------
+    # Jobs (estado visível a todos os workers do uvicorn; a execução fica no worker que aceitou)
+    # --------------------
+    def save_job(self, job):
+        """
+        Grava o estado de um job (formato de Job.to_dict).
+        """
+        self._write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO jobs (id, data, updated_at) VALUES (?, ?, ?)",
+            (job["job_id"], json.dumps(job, ensure_ascii=False), time.time()),
+        ))
+
+    def get_job(self, job_id):
+        row = self._conn().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # --------------------
+    # Relatórios gerados
+    # --------------------
+    def set_report(self, analysis_id, fmt, version, path):
+        def fn(conn):
+            conn.execute(
+                "INSERT OR REPLACE INTO reports (analysis_id, format, version, path, created_at) VALUES (?, ?, ?, ?, ?)",
+                (analysis_id, fmt, version, path, time.time()),
+            )
+        self._write(fn)
+
+    def get_report(self, analysis_id, fmt):
+        row = self._conn().execute(
+            "SELECT version, path FROM reports WHERE analysis_id = ? AND format = ?", (analysis_id, fmt)
+        ).fetchone()
+        return {"version": row[0], "path": row[1]} if row else None
@@ -172,33 +172,45 @@ export default function UploadPage() {
 
     const allComponents = Object.entries(analysisData.components).flatMap(([_, comps]) => comps);
     setTotalComponents(allComponents.length);
-    let processed = 0;
-
-    for (const comp of allComponents) {
-      try {
-        const res = await axios.post(`${apiUrl}/api/stride_incremental`, {
-          analysis_id: analysisData.analysis_id,
-          component: comp
-        });
-
-        setStrideData(prev => ({
-          ...prev,
-          [comp.label]: res.data.threats
-        }));
-
-        processed++;
-        setProgress(processed / allComponents.length);
-        setCurrentComponent(processed);
-      } catch (err) {
-        console.error(`Erro em ${comp.label}:`, err);
-        processed++;
-        setProgress(processed / allComponents.length);
-      }
-    }
 
-    setLoadingStride(false);
-    setStrideCompleted(true);
-    markStepCompleted(3);
+    const finish = () => {
+      setLoadingStride(false);
+      setStrideCompleted(true);
+      markStepCompleted(3);
+    };
+
+    if (allComponents.length === 0) return finish();
+
+    // Uma única conexão SSE; o navegador reconecta sozinho com Last-Event-ID
+    const source = new EventSource(`${apiUrl}/api/stride/${analysisData.analysis_id}/stream`);
+    const processedIds = new Set();
+    // O servidor informa o total de unidades (componentes + fluxos de fronteira)
+    let totalUnits = allComponents.length;
+
+    source.addEventListener("start", (e) => {
+      totalUnits = JSON.parse(e.data).units || totalUnits;
+      setTotalComponents(totalUnits);
+    });
+
+    source.addEventListener("component_done", (e) => {
+      const data = JSON.parse(e.data);
+      setStrideData(prev => ({ ...prev, [data.component]: data.threats }));
+      processedIds.add(data.component_id);
+      setProgress(Math.min(1, processedIds.size / totalUnits));
+      setCurrentComponent(processedIds.size);
+    });
+
+    source.addEventListener("done", () => {
+      source.close();
+      finish();
+    });
+
+    source.onerror = (err) => {
+      if (source.readyState === EventSource.CLOSED) {
+        console.error("Erro no streaming STRIDE:", err);
+        finish();
+      }
+    };
   };
 
   const handleDownloadReport = async (format) => {
@@ -475,7 +487,7 @@ export default function UploadPage() {
                 style={{ width: `${(progress || 0) * 100}%` }}
               />
               <div className="absolute inset-0 flex items-center justify-center text-white font-semibold pointer-events-none">
-                Processando componente {currentComponent + 1}/{totalComponents}
+                Processando componente {Math.min(currentComponent + 1, totalComponents)}/{totalComponents}
               </div>
             </div>
           )}